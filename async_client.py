@@ -0,0 +1,334 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+asyncio DNS client engine
+'''
+import asyncio
+import random
+from query import LazyMessage, QueryEncoder, short_struct, type_code
+from cache import DNSCache, make_key, chain_target, extend_answers
+from client import LookupResult
+from servers import RetryScheduler
+
+
+class DNSDatagramProtocol(asyncio.DatagramProtocol):
+    '''udp protocol passing datagrams to client
+    '''
+
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.response_received(data)
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        self.client.connection_lost(exc)
+
+
+class AsyncTCPConnection:
+    '''persistent tcp connection, pipelined queries matched by ID
+    '''
+
+
+    def __init__(self, server, port=53, ssl_context=None):
+        self.server = server
+        self.port = port
+        self.ssl_context = ssl_context
+        self.writer = None
+        self.reader_task = None
+        self.connect_lock = asyncio.Lock()
+        self.pending = {}
+
+    async def connect(self):
+        '''open connection, TLS when ssl context is given
+        '''
+        async with self.connect_lock:
+            if self.writer is not None:
+                return
+            reader, self.writer = await asyncio.open_connection(
+                self.server, self.port, ssl=self.ssl_context)
+            self.reader_task = asyncio.ensure_future(
+                self.read_responces(reader))
+
+    async def read_responces(self, reader):
+        '''resolve pending queries as responces arrive
+        '''
+        try:
+            while True:
+                length = short_struct.unpack(await reader.readexactly(2))[0]
+                data = await reader.readexactly(length)
+                format = LazyMessage()
+                try:
+                    format.decode(data)
+                except Exception:
+                    continue
+                future = self.pending.pop(format.header.messageID, None)
+                if future is not None and not future.done():
+                    future.set_result(format)
+        except (asyncio.IncompleteReadError, OSError) as exc:
+            self.connection_lost(exc)
+
+    def connection_lost(self, exc):
+        '''fail all outstanding queries
+        '''
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Connection closed'))
+        self.pending.clear()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def query(self, name, type, recursion_desired, encoder, timeout,
+            payload_size=None):
+        '''send framed query, returns decoded responce
+        '''
+        if self.writer is None:
+            await self.connect()
+        messageID = random.getrandbits(16)
+        while messageID in self.pending:
+            messageID = random.getrandbits(16)
+        message = encoder.encode(name, type, recursion_desired, messageID,
+            payload_size)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[messageID] = future
+        self.writer.write(short_struct.pack(len(message)) + message)
+        try:
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if self.pending.get(messageID) is future:
+                del self.pending[messageID]
+
+    def close(self):
+        '''close connection
+        '''
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        self.connection_lost(None)
+
+
+class AsyncDNSClient:
+    '''asyncio dns client, many queries in flight on one socket,
+    truncated responces are repeated over tcp
+    '''
+
+
+    def __init__(self, server='8.8.8.8', port=53, timeout=5, cache=None,
+            tcp=False, ssl_context=None, payload_size=1232, max_chain=8, 
+            scheduler=None, serve_stale=True, prefetch=True):
+        if cache is None:
+            cache = DNSCache()
+        if scheduler is None:
+            scheduler = RetryScheduler(budget=timeout)
+        self.scheduler = scheduler
+        self.cache = cache
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.tcp = tcp
+        self.payload_size = payload_size
+        self.max_chain = max_chain
+        self.serve_stale = serve_stale
+        self.prefetch = prefetch
+        self.tcp_connection = AsyncTCPConnection(server, port, ssl_context)
+        self.encoder = QueryEncoder()
+        self.transport = None
+        self.connect_lock = asyncio.Lock()
+        self.pending = {}
+        self.inflight = {}
+        self.coalesced = 0
+        self.refreshing = set()
+        self.refreshes = 0
+
+    async def connect(self):
+        '''open udp endpoint
+        '''
+        async with self.connect_lock:
+            if self.transport is not None:
+                return
+            loop = asyncio.get_running_loop()
+            self.transport, protocol = \
+                await loop.create_datagram_endpoint(
+                    lambda: DNSDatagramProtocol(self),
+                    remote_addr=(self.server, self.port))
+
+    def response_received(self, data):
+        '''match responce to query by ID and question
+        '''
+        format = LazyMessage()
+        try:
+            format.decode(data)
+        except Exception:
+            return
+        query = self.pending.get(format.header.messageID)
+        if query is None or len(format.questions) == 0:
+            return
+        question = format.questions[0]
+        key = make_key(question.name, question.type,
+            question.request_class)
+        if key != query[0] or query[1].done():
+            return
+        del self.pending[format.header.messageID]
+        query[1].set_result(format)
+
+    def connection_lost(self, exc):
+        '''fail all outstanding queries
+        '''
+        for query in self.pending.values():
+            if not query[1].done():
+                query[1].set_exception(
+                    exc or ConnectionError('Connection closed'))
+        self.pending.clear()
+        self.transport = None
+
+    async def query(self, name, type=1, recursion_desired=True):
+        '''send query, returns decoded responce, concurrent identical
+        queries share one upstream query and its responce
+        '''
+        key = (make_key(name, type), recursion_desired)
+        flight = self.inflight.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(self.query_upstream(name, type, 
+                recursion_desired))
+            self.inflight[key] = flight
+            flight.add_done_callback(lambda flight: self.landed(key, 
+                flight))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(flight)
+
+    def landed(self, key, flight):
+        '''forget finished upstream query
+        '''
+        if self.inflight.get(key) is flight:
+            del self.inflight[key]
+        if not flight.cancelled():
+            flight.exception()
+
+    async def query_upstream(self, name, type=1, recursion_desired=True):
+        '''send query, returns decoded responce
+        '''
+        if self.tcp:
+            return await self.tcp_connection.query(name, type,
+                recursion_desired, self.encoder, self.timeout,
+                self.payload_size)
+        format = await self.query_udp(name, type, recursion_desired,
+            self.payload_size)
+        if format.header.rcode == 1 and self.payload_size is not None:
+            format = await self.query_udp(name, type, recursion_desired)
+        if format.header.tc:
+            format = await self.tcp_connection.query(name, type,
+                recursion_desired, self.encoder, self.timeout,
+                self.payload_size)
+        return format
+
+    async def query_udp(self, name, type=1, recursion_desired=True,
+            payload_size=None):
+        '''send query over udp, retransmits with backoff until timeout,
+        returns decoded responce
+        '''
+        if self.transport is None:
+            await self.connect()
+        messageID = random.getrandbits(16)
+        while messageID in self.pending:
+            messageID = random.getrandbits(16)
+        message = self.encoder.encode(name, type, recursion_desired, 
+            messageID, payload_size)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[messageID] = (make_key(name, type), future)
+        try:
+            for timeout in self.scheduler.timeouts():
+                self.transport.sendto(message)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), 
+                        timeout)
+                except asyncio.TimeoutError:
+                    continue
+            raise asyncio.TimeoutError()
+        finally:
+            if self.pending.get(messageID, (None, None))[1] is future:
+                del self.pending[messageID]
+
+    async def resolve(self, name, type=1, recursion_desired=True):
+        '''resolve name chasing CNAME chain, returns answer records
+        '''
+        answers, target = self.cache.get_chain(name, type, 
+            max_length=self.max_chain, stale=self.serve_stale, 
+            prefetch=self.prefetch)
+        self.refresh_due(recursion_desired)
+        chain = set()
+        while target is not None:
+            chain.add(target)
+            format = await self.query(target, type, recursion_desired)
+            self.cache.store_response(target, type, 1, format)
+            answers = extend_answers(answers, format.answers)
+            target = chain_target(format.answers, target, type)
+            if target is not None and target not in chain:
+                cached, target = self.cache.get_chain(target, type, 
+                    max_length=self.max_chain, stale=self.serve_stale, 
+                    prefetch=self.prefetch)
+                self.refresh_due(recursion_desired)
+                answers = extend_answers(answers, cached)
+            if target in chain or len(chain) >= self.max_chain:
+                break
+        return answers
+
+    def refresh_due(self, recursion_desired=True):
+        '''starts background refresh of cache entries due for it
+        '''
+        for name, type, request_class in self.cache.take_due():
+            task = asyncio.ensure_future(self.refresh(name, type, 
+                recursion_desired))
+            self.refreshing.add(task)
+            task.add_done_callback(self.refreshing.discard)
+
+    async def refresh(self, name, type, recursion_desired=True):
+        '''re-query cached name, stale entry stays when upstream fails
+        '''
+        try:
+            format = await self.query(name, type, recursion_desired)
+        except Exception:
+            return
+        self.cache.store_response(name, type, 1, format)
+        self.refreshes += 1
+
+    async def lookup(self, name, types=(1, 28), recursion_desired=True):
+        '''resolves all record types concurrently, returns LookupResult,
+        types that failed are missing
+        '''
+        result = LookupResult(name)
+        missing = []
+        for type in types:
+            type = type_code(type)
+            entry = self.cache.get(name, type, stale=self.serve_stale, 
+                prefetch=self.prefetch)
+            if entry is None:
+                missing.append(type)
+            else:
+                result.add(type, entry.rcode, entry.records)
+        self.refresh_due(recursion_desired)
+        responces = await asyncio.gather(*[self.query(name, type, 
+            recursion_desired) for type in missing], return_exceptions=True)
+        for type, format in zip(missing, responces):
+            if isinstance(format, Exception):
+                result.errors[type] = str(format) or \
+                    format.__class__.__name__
+                continue
+            self.cache.store_response(name, type, 1, format)
+            result.add(type, format.header.rcode, format.answers)
+        return result
+
+    def close(self):
+        '''close sockets, cancels background refreshes
+        '''
+        for task in list(self.refreshing):
+            task.cancel()
+        self.tcp_connection.close()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
@@ -0,0 +1,128 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+bulk resolution of many names
+'''
+import asyncio
+import json
+import sys
+import time
+from async_client import AsyncDNSClient
+from query import answer_addresses
+
+
+def read_names(stream):
+    '''yields host names, one per line
+    '''
+    for line in stream:
+        name = line.strip()
+        if name and not name.startswith('#'):
+            yield name
+
+def percentile(values, fraction):
+    '''value at fraction of sorted list
+    '''
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summarize(latencies, errors, elapsed):
+    '''throughput and latency summary line
+    '''
+    latencies = sorted(latencies)
+    count = len(latencies)
+    if elapsed > 0:
+        rate = count / elapsed
+    else:
+        rate = 0.0
+    return ('{0} names, {1} errors in {2:.3f}s ({3:.1f} q/s), ' \
+        'latency p50 {4:.1f}ms p90 {5:.1f}ms p99 {6:.1f}ms ' \
+        'max {7:.1f}ms').format(count, errors, elapsed, rate,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.9) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            percentile(latencies, 1.0) * 1000)
+
+def format_result(name, addresses, elapsed, error, json_output=False):
+    '''one result line, tab separated or json
+    '''
+    if json_output:
+        result = { 'name':name, 'answers':list(addresses),
+            'time_ms':round(elapsed * 1000, 3) }
+        if error is not None:
+            result['error'] = error
+        return json.dumps(result)
+    elif error is not None:
+        return '{0}\tERROR {1}'.format(name, error)
+    return '{0}\t{1}'.format(name, ' '.join(addresses))
+
+
+class BatchResolver:
+    '''resolves names concurrently with bounded window
+    '''
+
+
+    def __init__(self, client, concurrency=100, json_output=False,
+            output=sys.stdout, recursion_desired=True):
+        self.client = client
+        self.recursion_desired = recursion_desired
+        self.concurrency = concurrency
+        self.json_output = json_output
+        self.output = output
+        self.latencies = []
+        self.errors = 0
+
+    async def worker(self, names, type):
+        '''resolves names until iterator is exhausted
+        '''
+        for name in names:
+            start = time.perf_counter()
+            error = None
+            addresses = []
+            try:
+                answers = await self.client.resolve(name, type,
+                    self.recursion_desired)
+                addresses = answer_addresses(answers)
+            except asyncio.TimeoutError:
+                error = 'timeout'
+            except Exception as exc:
+                error = str(exc) or exc.__class__.__name__
+            elapsed = time.perf_counter() - start
+            self.latencies.append(elapsed)
+            if error is not None:
+                self.errors += 1
+            self.write_result(name, addresses, elapsed, error)
+
+    def write_result(self, name, addresses, elapsed, error):
+        '''streams one result line
+        '''
+        print(format_result(name, addresses, elapsed, error,
+            self.json_output), file=self.output)
+
+    async def run(self, names, type=1):
+        '''resolves all names, returns elapsed seconds
+        '''
+        start = time.perf_counter()
+        names = iter(names)
+        try:
+            await asyncio.gather(*[self.worker(names, type)
+                for i in range(self.concurrency)])
+        finally:
+            self.client.close()
+        return time.perf_counter() - start
+
+    def summary(self, elapsed):
+        '''throughput and latency summary
+        '''
+        return summarize(self.latencies, self.errors, elapsed)
+
+
+def resolve_batch(stream, server='8.8.8.8', concurrency=100, timeout=5,
+        recursion_desired=True, json_output=False, type=1, tcp=False):
+    '''resolves names from stream, prints results and summary
+    '''
+    client = AsyncDNSClient(server=server, timeout=timeout, tcp=tcp)
+    resolver = BatchResolver(client, concurrency, json_output,
+        recursion_desired=recursion_desired)
+    elapsed = asyncio.run(resolver.run(read_names(stream), type))
+    print(resolver.summary(elapsed), file=sys.stderr)
+    return resolver
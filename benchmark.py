@@ -0,0 +1,204 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+parser and encoder benchmarks over recorded responce corpus
+'''
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from query import DNSMessageFormat, LazyMessage, QueryEncoder, \
+    AResourceData, AAAAResourceData, decode_string
+from columns import ResponseTable
+
+
+directory = os.path.dirname(os.path.abspath(__file__))
+corpus_path = os.path.join(directory, 'benchmark_corpus.txt')
+baseline_path = os.path.join(directory, 'benchmark_baseline.json')
+
+
+def read_corpus(path=corpus_path):
+    '''list of (name, message) from hex corpus file
+    '''
+    corpus = []
+    with open(path) as lines:
+        for line in lines:
+            line = line.split()
+            if len(line) == 2 and not line[0].startswith('#'):
+                corpus.append((line[0], bytes.fromhex(line[1])))
+    return corpus
+
+def operations_per_second(function, number, repeat=3):
+    '''best rate of repeated runs
+    '''
+    return number / min(timeit.repeat(function, number=number,
+        repeat=repeat))
+
+def retained_blocks(function, number):
+    '''memory blocks still allocated per call when results are kept,
+    temporaries freed during the call are not counted
+    '''
+    results = []
+    before = sys.getallocatedblocks()
+    for i in range(number):
+        results.append(function())
+    blocks = sys.getallocatedblocks() - before
+    return blocks / number
+
+def peak_bytes(function, number):
+    '''mean peak of memory allocated during one call, temporaries
+    included
+    '''
+    tracemalloc.start()
+    total = 0
+    for i in range(number):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = function()
+        total += tracemalloc.get_traced_memory()[1] - before
+        del result
+    tracemalloc.stop()
+    return total / number
+
+def bytes_per_record(message, number):
+    '''bytes held per decoded resource record
+    '''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    formats = []
+    for i in range(number):
+        format = DNSMessageFormat()
+        format.decode(message)
+        formats.append(format)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    header = formats[0].header
+    records = header.an_count + header.ns_count + header.ar_count
+    return used / (number * max(records, 1))
+
+def decoder(message):
+    '''decode message, returns decoded format
+    '''
+    def decode():
+        format = DNSMessageFormat()
+        format.decode(message)
+        return format
+    return decode
+
+def lazy_answers(message):
+    '''decode message view, materialize answers only
+    '''
+    def decode():
+        format = LazyMessage()
+        format.decode(message)
+        return list(format.answers)
+    return decode
+
+def column_decoder(message, rows=1000):
+    '''add message to columns, a fresh table every rows calls keeps
+    runs from growing one table without bound
+    '''
+    tables = [ResponseTable()]
+    def decode():
+        table = tables[0]
+        if len(table) >= rows:
+            table = tables[0] = ResponseTable()
+        table.add(message)
+    return decode
+
+def benchmarks(corpus):
+    '''list of (name, function) hot path benchmarks
+    '''
+    result = []
+    for name, message in corpus:
+        result.append(('decode/' + name, decoder(message)))
+    for name, message in corpus:
+        result.append(('decode_lazy/' + name, lazy_answers(message)))
+    for name, message in corpus:
+        result.append(('decode_columns/' + name, column_decoder(message)))
+    for name, message in corpus:
+        result.append(('decode_string/' + name,
+            lambda message=message: decode_string(message, 12, {})))
+    encoder = QueryEncoder()
+    result.append(('encode', lambda: DNSMessageFormat().encode(
+        'tags.bluekai.com', True, False)))
+    result.append(('encode_template', lambda: encoder.encode(
+        'tags.bluekai.com', 1, True, 4660, 1232)))
+    address = bytes.fromhex('2a00145040100801000000000000200e')
+    result.append(('aaaa', lambda: AAAAResourceData(address).ip))
+    result.append(('aaaa_raw', lambda: AAAAResourceData(address).packed))
+    result.append(('a', lambda: AResourceData(b'\x5d\xb8\xd8\x22').ip))
+    return result
+
+def run_suite(corpus, number=5000):
+    '''rates, retained blocks and peak bytes per call for every
+    benchmark
+    '''
+    results = {}
+    for name, function in benchmarks(corpus):
+        results[name] = { 'ops':operations_per_second(function, number),
+            'retained_blocks':retained_blocks(function, min(number, 1000)),
+            'peak_bytes':peak_bytes(function, min(number, 200)) }
+    for name, message in corpus:
+        results['memory/' + name] = { 'bytes_per_record':
+            bytes_per_record(message, min(number, 1000)) }
+    return results
+
+def regressions(results, baseline, tolerance):
+    '''benchmarks slower than baseline by more than tolerance
+    '''
+    result = []
+    for name, values in sorted(baseline.items()):
+        if 'ops' not in values or name not in results:
+            continue
+        ratio = results[name]['ops'] / values['ops']
+        if ratio < 1 - tolerance:
+            result.append((name, values['ops'], results[name]['ops']))
+    return result
+
+def print_results(results, baseline):
+    '''table of results against baseline
+    '''
+    for name, values in sorted(results.items()):
+        if 'ops' in values:
+            line = '{0:<36} {1:>12.0f} op/s {2:>7.1f} retained blocks ' \
+                '{3:>8.0f} peak bytes'.format(name, values['ops'], 
+                    values['retained_blocks'], values['peak_bytes'])
+            if name in baseline:
+                line += ' ({0:+.1f}%)'.format(100 * (values['ops'] /
+                    baseline[name]['ops'] - 1))
+        else:
+            line = '{0:<36} {1:>12.0f} bytes/record'.format(name,
+                values['bytes_per_record'])
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DNS codec benchmarks')
+    parser.add_argument('--number', '-n', type=int, default=5000,
+        help='Calls per timing run')
+    parser.add_argument('--save', action='store_true',
+        help='Store results as new baseline')
+    parser.add_argument('--check', action='store_true',
+        help='Exit with error when slower than baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help='Allowed slowdown fraction for --check')
+    parsed = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+    results = run_suite(read_corpus(), parsed.number)
+    print_results(results, baseline)
+    if parsed.save:
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=1, sort_keys=True)
+    if parsed.check:
+        slower = regressions(results, baseline, parsed.tolerance)
+        for name, expected, actual in slower:
+            print('REGRESSION {0}: {1:.0f} -> {2:.0f} op/s'.format(name,
+                expected, actual))
+        if slower:
+            exit(1)
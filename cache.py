@@ -0,0 +1,329 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+dns answer cache
+'''
+import time
+from collections import OrderedDict
+
+
+def normalize_name(name):
+    '''lowercase name without trailing dot
+    '''
+    if name.endswith('.'):
+        name = name[:-1]
+    return name.lower()
+
+def make_key(name, type, request_class=1):
+    '''cache key for question
+    '''
+    return (normalize_name(name), type, request_class)
+
+def is_subdomain(name, zone):
+    '''name is zone or below it, both normalized
+    '''
+    return zone == '' or name == zone or name.endswith('.' + zone)
+
+def in_bailiwick(records, zone):
+    '''records owned by zone or names below it, all records when zone
+    is None
+    '''
+    if zone is None:
+        return records
+    return [rr for rr in records if is_subdomain(normalize_name(rr.name), 
+        zone)]
+
+def extend_answers(answers, records):
+    '''answers followed by records, records itself when answers is empty
+    '''
+    if len(answers) == 0:
+        return records
+    return list(answers) + list(records)
+
+def chain_target(records, name, type):
+    '''name the CNAME chain from name ends at when records hold no
+    records of type for it, else None
+    '''
+    name = normalize_name(name)
+    if type == 5:
+        return None
+    aliases = {}
+    for rr in records:
+        if rr.type == 5:
+            aliases[normalize_name(rr.name)] = normalize_name(
+                rr.resource_data.name)
+    seen = set()
+    while name in aliases and name not in seen:
+        seen.add(name)
+        name = aliases[name]
+    if len(seen) == 0:
+        return None
+    for rr in records:
+        if rr.type == type and normalize_name(rr.name) == name:
+            return None
+    return name
+
+
+class CacheEntry:
+    '''cache entry class
+    '''
+
+
+    def __init__(self, records, rcode, expires, ttl=0):
+        self.records = records
+        self.rcode = rcode
+        self.expires = expires
+        self.ttl = ttl
+        self.hits = 0
+        self.refreshed = None
+
+    def is_negative(self):
+        '''NXDOMAIN or NODATA entry
+        '''
+        return len(self.records) == 0
+
+
+class DNSCache:
+    '''ttl-aware lru answer cache, entries hit prefetch_hits times in the
+    last prefetch_fraction of their ttl are due for refresh, expired
+    entries are kept stale_ttl seconds more for serve-stale (RFC 8767),
+    prefetch_fraction=0 or stale_ttl=0 turns either off
+    '''
+
+
+    def __init__(self, max_size=10000, clock=time.monotonic, 
+            prefetch_fraction=0.1, prefetch_hits=2, stale_ttl=86400, 
+            refresh_interval=30):
+        self.max_size = max_size
+        self.clock = clock
+        self.prefetch_fraction = prefetch_fraction
+        self.prefetch_hits = prefetch_hits
+        self.stale_ttl = stale_ttl
+        self.refresh_interval = refresh_interval
+        self.entries = OrderedDict()
+        self.due = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, name, type, request_class=1, stale=False, 
+            prefetch=False):
+        '''cached entry or None
+        '''
+        entry = self.find(make_key(name, type, request_class), stale, 
+            prefetch)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def find(self, key, stale=False, prefetch=False):
+        '''live entry or None, without counting, stale callers also get
+        expired entries, keys of those and, for prefetch callers, of hot
+        entries near expiry are listed by take_due for refresh
+        '''
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        now = self.clock()
+        if entry.expires <= now:
+            if entry.expires + self.stale_ttl <= now:
+                del self.entries[key]
+                return None
+            if not stale:
+                return None
+            self.stale_hits += 1
+        self.entries.move_to_end(key)
+        if entry.expires - now <= self.prefetch_fraction * entry.ttl:
+            entry.hits += 1
+        if self.refresh_due(entry, now, stale, prefetch):
+            entry.refreshed = now
+            self.due.append(key)
+        return entry
+
+    def refresh_due(self, entry, now, stale=True, prefetch=True):
+        '''entry is expired (when stale) or hot near the end of its ttl
+        (when prefetch) and was not refreshed in last refresh_interval
+        seconds
+        '''
+        if not (stale or prefetch) or entry.refreshed is not None and \
+                now - entry.refreshed < self.refresh_interval:
+            return False
+        if entry.expires <= now:
+            return stale
+        return prefetch and entry.hits >= self.prefetch_hits and \
+            entry.expires - now <= self.prefetch_fraction * entry.ttl
+
+    def take_due(self):
+        '''keys due for refresh since last call
+        '''
+        due = self.due
+        self.due = []
+        return due
+
+    def get_chain(self, name, type, request_class=1, max_length=8, 
+            stale=False, prefetch=False):
+        '''follows cached CNAME links from name, returns (records, target)
+        where target is the name still to be queried, None when cache
+        completes the answer or chain loops or exceeds max_length
+        '''
+        name = normalize_name(name)
+        records = []
+        seen = set([name])
+        for i in range(max_length + 1):
+            entry = self.find((name, type, request_class), stale, 
+                prefetch)
+            if entry is not None:
+                records = extend_answers(records, entry.records)
+                target = chain_target(entry.records, name, type)
+                if target is None:
+                    self.hits += 1
+                    return (records, None)
+                name = target
+            else:
+                link = None
+                if type != 5:
+                    link = self.find((name, 5, request_class), stale, 
+                        prefetch)
+                if link is None or link.is_negative():
+                    self.misses += 1
+                    return (records, name)
+                records = extend_answers(records, link.records)
+                name = normalize_name(link.records[0].resource_data.name)
+            if name in seen:
+                break
+            seen.add(name)
+        self.hits += 1
+        return (records, None)
+
+    def put(self, name, type, request_class, records, rcode, ttl):
+        '''store records for ttl seconds
+        '''
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        key = make_key(name, type, request_class)
+        self.entries[key] = CacheEntry(records, rcode, self.clock() + ttl, 
+            ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def store_response(self, name, type, request_class, format, 
+            zone=None):
+        '''cache decoded response, negative answers use SOA minimum,
+        with zone only answers owned inside it are kept (bailiwick),
+        truncated responses are not cached
+        '''
+        rcode = format.header.rcode
+        if rcode != 0 and rcode != 3 or format.header.tc:
+            return
+        if rcode == 0 and len(format.answers) > 0:
+            answers = in_bailiwick(format.answers, zone)
+            if len(answers) > 0:
+                ttl = min(answer.ttl for answer in answers)
+                self.store_links(name, type, request_class, answers)
+                self.put(name, type, request_class, answers, rcode, ttl)
+            return
+        for rr in format.authority_RRs:
+            if rr.type == 6:
+                ttl = min(rr.ttl, rr.resource_data.minimum)
+                self.put(name, type, request_class, [], rcode, ttl)
+                return
+
+    def store_links(self, name, type, request_class, answers):
+        '''caches each CNAME link under its alias and records of chain
+        target under target, each with own ttl
+        '''
+        name = normalize_name(name)
+        targets = {}
+        for rr in answers:
+            owner = normalize_name(rr.name)
+            if rr.type == 5:
+                self.put(owner, 5, request_class, [rr], 0, rr.ttl)
+            elif rr.type == type and owner != name:
+                targets.setdefault(owner, []).append(rr)
+        for owner, records in targets.items():
+            self.put(owner, type, request_class, records, 0, 
+                min(rr.ttl for rr in records))
+
+    def clear(self):
+        '''drop all entries
+        '''
+        self.entries.clear()
+
+    def stats(self):
+        '''hit/miss/eviction counters
+        '''
+        return { 'size':len(self.entries), 'hits':self.hits,
+            'misses':self.misses, 'evictions':self.evictions, 
+            'stale':self.stale_hits }
+
+
+class Delegation:
+    '''zone nameservers with known addresses
+    '''
+
+
+    def __init__(self, zone, names, addresses, expires):
+        self.zone = zone
+        self.names = names
+        self.addresses = addresses
+        self.expires = expires
+
+    def servers(self):
+        '''known nameserver addresses
+        '''
+        result = []
+        for name in self.names:
+            result.extend(self.addresses.get(name, []))
+        return result
+
+    def glueless_names(self):
+        '''nameservers without known addresses
+        '''
+        return [name for name in self.names if name not in self.addresses]
+
+
+class DelegationCache:
+    '''zone to nameserver set cache
+    '''
+
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.zones = {}
+
+    def __len__(self):
+        return len(self.zones)
+
+    def put(self, zone, names, addresses, ttl):
+        '''store delegation for ttl seconds
+        '''
+        delegation = Delegation(normalize_name(zone), names, addresses,
+            self.clock() + ttl)
+        self.zones[delegation.zone] = delegation
+        return delegation
+
+    def find(self, name):
+        '''closest enclosing delegation or None
+        '''
+        name = normalize_name(name)
+        now = self.clock()
+        while True:
+            delegation = self.zones.get(name)
+            if delegation is not None:
+                if delegation.expires > now:
+                    return delegation
+                del self.zones[name]
+            if name == '':
+                return None
+            dot = name.find('.')
+            if dot < 0:
+                name = ''
+            else:
+                name = name[dot + 1:]
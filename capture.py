@@ -0,0 +1,269 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+streaming reader of DNS messages from pcap and length-prefixed dumps
+'''
+import argparse
+import struct
+import time
+from query import DNSMessageFormat, LazyMessage, short_struct
+
+
+pcap_magics = { b'\xd4\xc3\xb2\xa1':'<', b'\xa1\xb2\xc3\xd4':'>',
+    b'\x4d\x3c\xb2\xa1':'<', b'\xa1\xb2\x3c\x4d':'>' }
+pcapng_magic = b'\x0a\x0d\x0d\x0a'
+ipv4_struct = struct.Struct('>BxHHHBB')
+ports_struct = struct.Struct('>HHH')
+tcp_struct = struct.Struct('>HHI5xB')
+
+
+def split_records(stream, prefix, length_index, chunk_size):
+    '''yields (prefix fields, body) of length-prefixed records, reads
+    stream in chunks, stops at truncated record
+    '''
+    buffer = b''
+    offset = 0
+    while True:
+        end = len(buffer)
+        while offset + prefix.size <= end:
+            fields = prefix.unpack_from(buffer, offset)
+            start = offset + prefix.size
+            stop = start + fields[length_index]
+            if stop > end:
+                break
+            yield fields, buffer[start:stop]
+            offset = stop
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        buffer = buffer[offset:] + chunk
+        offset = 0
+
+def write_framed(stream, messages):
+    '''writes messages with 2-byte length prefix
+    '''
+    for message in messages:
+        stream.write(short_struct.pack(len(message)) + message)
+
+def ip_payload(packet, offset):
+    '''(protocol, source, destination, payload start, end) of IPv4 or
+    IPv6 packet at offset, None for fragments and other packets
+    '''
+    if len(packet) < offset + 20:
+        return None
+    version = packet[offset] >> 4
+    if version == 4:
+        first, length, identification, fragment, ttl, protocol = \
+            ipv4_struct.unpack_from(packet, offset)
+        if fragment & 0x3fff:
+            return None
+        return (protocol, packet[offset + 12:offset + 16],
+            packet[offset + 16:offset + 20], offset + (first & 15) * 4,
+            min(len(packet), offset + length))
+    elif version == 6 and len(packet) >= offset + 40:
+        length = short_struct.unpack_from(packet, offset + 4)[0]
+        return (packet[offset + 6], packet[offset + 8:offset + 24],
+            packet[offset + 24:offset + 40], offset + 40,
+            min(len(packet), offset + 40 + length))
+    return None
+
+
+class TCPStream:
+    '''one direction of tcp connection, reassembles in-order segments
+    and splits 2-byte framed messages, first segment seen is taken as
+    message boundary, data after a gap is dropped
+    '''
+
+    __slots__ = ('next', 'buffer', 'synced')
+
+    def __init__(self):
+        self.next = None
+        self.buffer = bytearray()
+        self.synced = False
+
+    def feed(self, seq, flags, payload):
+        '''list of messages completed by segment
+        '''
+        if flags & 2:
+            self.next = (seq + 1) & 0xffffffff
+            self.buffer.clear()
+            self.synced = True
+            return []
+        if self.next is None:
+            self.next = seq
+            self.synced = True
+        gap = (seq - self.next) & 0xffffffff
+        if gap >= 0x80000000:
+            overlap = 0x100000000 - gap
+            if overlap >= len(payload):
+                return []
+            payload = payload[overlap:]
+        elif gap > 0:
+            self.buffer.clear()
+            self.synced = False
+            self.next = seq
+        self.next = (self.next + len(payload)) & 0xffffffff
+        if not self.synced:
+            return []
+        buffer = self.buffer
+        buffer += payload
+        messages = []
+        offset = 0
+        while offset + 2 <= len(buffer):
+            end = offset + 2 + short_struct.unpack_from(buffer, offset)[0]
+            if end > len(buffer):
+                break
+            messages.append(bytes(buffer[offset + 2:end]))
+            offset = end
+        if offset > 0:
+            del buffer[:offset]
+        return messages
+
+
+class DumpReader:
+    '''streams DNS messages from pcap captures (udp and tcp on port) or
+    raw length-prefixed dumps, undecodable messages are counted and
+    skipped
+    '''
+
+
+    def __init__(self, lazy=True, port=53, chunk_size=1 << 20,
+            max_flows=10000):
+        if lazy:
+            self.factory = LazyMessage
+        else:
+            self.factory = DNSMessageFormat
+        self.port = port
+        self.chunk_size = chunk_size
+        self.max_flows = max_flows
+        self.flows = {}
+        self.packets = 0
+        self.messages = 0
+        self.malformed = 0
+
+    def decode(self, payloads):
+        '''yields decoded messages
+        '''
+        for payload in payloads:
+            format = self.factory()
+            try:
+                format.decode(payload)
+            except Exception:
+                self.malformed += 1
+                continue
+            self.messages += 1
+            yield format
+
+    def read(self, path):
+        '''yields messages of pcap or length-prefixed dump file
+        '''
+        with open(path, 'rb') as stream:
+            magic = stream.read(4)
+            stream.seek(0)
+            if magic in pcap_magics or magic == pcapng_magic:
+                yield from self.pcap(stream)
+            else:
+                yield from self.framed(stream)
+
+    def framed(self, stream):
+        '''yields messages of length-prefixed dump stream
+        '''
+        yield from self.decode(body for fields, body in split_records(
+            stream, short_struct, 0, self.chunk_size))
+
+    def pcap(self, stream):
+        '''yields messages of pcap stream
+        '''
+        yield from self.decode(self.payloads(stream))
+
+    def payloads(self, stream):
+        '''yields raw DNS messages of pcap stream
+        '''
+        header = stream.read(24)
+        if header[0:4] == pcapng_magic:
+            raise ValueError('pcapng is not supported, convert with ' \
+                'editcap -F pcap')
+        if len(header) < 24 or header[0:4] not in pcap_magics:
+            raise ValueError('Not a pcap file')
+        order = pcap_magics[header[0:4]]
+        link_type = struct.unpack_from(order + 'I', header, 20)[0] & 0xffff
+        record = struct.Struct(order + 'IIII')
+        for fields, packet in split_records(stream, record, 2,
+                self.chunk_size):
+            self.packets += 1
+            offset = self.link_offset(link_type, packet)
+            if offset is None:
+                continue
+            ip = ip_payload(packet, offset)
+            if ip is None:
+                continue
+            protocol, source, destination, start, end = ip
+            if protocol == 17 and start + 8 <= end:
+                source_port, destination_port, length = \
+                    ports_struct.unpack_from(packet, start)
+                if self.port in (source_port, destination_port):
+                    yield packet[start + 8:min(end, start + length)]
+            elif protocol == 6 and start + 20 <= end:
+                source_port, destination_port, seq, flags = \
+                    tcp_struct.unpack_from(packet, start)
+                if self.port in (source_port, destination_port):
+                    yield from self.tcp(source + destination,
+                        source_port, destination_port, seq, flags,
+                        packet[start + (packet[start + 12] >> 4) * 4:end])
+
+    def link_offset(self, link_type, packet):
+        '''offset of IP header in captured frame, None when not IP
+        '''
+        if link_type == 1:
+            offset = 12
+            while packet[offset:offset + 2] in (b'\x81\x00', b'\x88\xa8'):
+                offset += 4
+            if packet[offset:offset + 2] not in (b'\x08\x00', b'\x86\xdd'):
+                return None
+            return offset + 2
+        elif link_type in (101, 228, 229, 12, 14):
+            return 0
+        elif link_type in (0, 108):
+            return 4
+        elif link_type == 113:
+            return 16
+        elif link_type == 276:
+            return 20
+        return None
+
+    def tcp(self, addresses, source_port, destination_port, seq, flags,
+            payload):
+        '''framed messages completed by tcp segment
+        '''
+        key = (addresses, source_port, destination_port)
+        flow = self.flows.get(key)
+        if flow is None:
+            if flags & 5:
+                return []
+            flow = self.flows[key] = TCPStream()
+            if len(self.flows) > self.max_flows:
+                del self.flows[next(iter(self.flows))]
+        messages = flow.feed(seq, flags, payload)
+        if flags & 5:
+            del self.flows[key]
+        return messages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Count DNS messages in pcap or length-prefixed dump')
+    parser.add_argument('dump', help='Capture or dump file')
+    parser.add_argument('--port', '-p', type=int, default=53,
+        help='DNS port in captures')
+    parsed = parser.parse_args()
+
+    reader = DumpReader(port=parsed.port)
+    queries = 0
+    start = time.perf_counter()
+    for format in reader.read(parsed.dump):
+        if not format.header.qr:
+            queries += 1
+    elapsed = time.perf_counter() - start
+    print('{0} messages ({1} queries, {2} responces), {3} malformed, ' \
+        '{4} packets, {5:.0f} msg/s'.format(reader.messages, queries,
+            reader.messages - queries, reader.malformed, reader.packets,
+            reader.messages / max(elapsed, 1e-9)))
@@ -3,7 +3,51 @@ Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
 DNS client engine
 '''
 import socket
-from query import DNSMessageFormat
+import random
+import time
+from query import QueryEncoder, print_answers, answer_addresses, \
+    type_code, query_type_names
+from cache import DNSCache, make_key, chain_target, extend_answers
+from resolver import IterativeResolver, ResolveError
+from servers import ServerSelector, RetryScheduler, exchange, exchange_many
+from tcp import TCPConnectionPool
+
+
+class LookupResult:
+    '''answers of multi-type lookup, records[type] lists answer records,
+    errors[type] says why a type got no answer
+    '''
+
+
+    def __init__(self, name):
+        self.name = name
+        self.records = {}
+        self.rcodes = {}
+        self.errors = {}
+
+    def add(self, type, rcode, records):
+        '''store answers of one type
+        '''
+        self.rcodes[type] = rcode
+        self.records[type] = records
+
+    def __getitem__(self, type):
+        return self.records.get(type_code(type), [])
+
+    def addresses(self, raw=False):
+        '''A then AAAA addresses
+        '''
+        return answer_addresses(self[1], raw) + answer_addresses(self[28], 
+            raw)
+
+    def print(self):
+        '''answers grouped by type
+        '''
+        for type, records in self.records.items():
+            print('{0}:'.format(query_type_names.get(type, type)))
+            for record in records:
+                if record.type == type:
+                    record.resource_data.print()
 
 
 class DNSClient:
@@ -11,59 +55,267 @@ class DNSClient:
     '''
 
 
-    def __init__(self, server='8.8.8.8'):
+    def __init__(self, server='8.8.8.8', cache=None, selector=None, 
+            fanout=1, port=53, payload_size=1232, metrics=None, 
+            max_chain=8, scheduler=None):
+        if cache is None:
+            cache = DNSCache()
+        if selector is None:
+            selector = ServerSelector()
+        if scheduler is None:
+            scheduler = RetryScheduler()
+        self.cache = cache
+        self.selector = selector
+        self.scheduler = scheduler
+        self.fanout = fanout
+        self.port = port
+        self.payload_size = payload_size
+        self.metrics = metrics
+        self.max_chain = max_chain
+        self.tcp_pool = TCPConnectionPool(port=port)
+        self.encoder = QueryEncoder()
+        self.resolver = None
         self.socket = socket.socket(socket.AF_INET, 
             socket.SOCK_DGRAM)
-        self.socket.settimeout(5)
-        self.connect_server(server)
+        self.servers = []
+        self.server = None
+        if isinstance(server, str):
+            server = [server]
+        for address in server:
+            self.connect_server(address)
 
     def connect_server(self, server):
-        '''connection
+        '''adds server to the set queries are sent to
         '''
         try:
-            self.socket.connect((server, 53))
+            address = socket.gethostbyname(server)
         except Exception:
             print('Unable to connect to server {0}'.format(server))
             return False
-        self.server = server
+        if address not in self.servers:
+            self.servers.append(address)
+        if self.server is None:
+            self.server = address
         return True
 
     def send_query(self, request, recursion_desired=True, 
             debug_mode=False, IPv6=False):
-        '''request
+        '''request, chases CNAME chain, returns answer records
         '''
-        format = DNSMessageFormat()
-        query = format.encode(request, recursion_desired, IPv6)
-        self.socket.send(query)
-        try:
-            responce = self.socket.recv(1024)
-        except Exception:
-            print('Time Out: {0}'.format(self.server))
-            exit(0)
-        format.decode(responce)
-
-        if debug_mode:
-            print('#################  RESPONCE from {0} ' \
-                ' ##################'.format(self.server))
-            format.print()
-        
-        if len(format.answers) > 0:
+        if IPv6:
+            query_type = 28
+        else:
+            query_type = 1
+        answers, target = self.cache.get_chain(request, query_type, 
+            max_length=self.max_chain)
+        if target is None:
+            if self.metrics is not None:
+                self.metrics.count('cache_hits')
+            print_answers(answers)
+            return answers
+        if self.metrics is not None:
+            self.metrics.count('cache_misses')
+            start = time.perf_counter()
+        if not recursion_desired:
+            answers = self.send_iterative(request, query_type, debug_mode)
+            if self.metrics is not None:
+                self.metrics.observe('query_seconds', None, 
+                    time.perf_counter() - start)
+            return answers
+        chain = set()
+        while target is not None:
+            chain.add(target)
+            server, format = self.query(target, query_type, 
+                recursion_desired)
+            if format is None:
+                print('Time Out: {0}'.format(', '.join(self.servers)))
+                break
+            self.server = server
+            if self.metrics is not None:
+                self.metrics.count('responses', server, 
+                    rcode=format.header.rcode)
+            self.cache.store_response(target, query_type, 1, format)
+            if debug_mode:
+                print('#################  RESPONCE from {0} ' \
+                    ' ##################'.format(self.server))
+                format.print()
+            answers = extend_answers(answers, format.answers)
+            target = chain_target(format.answers, target, query_type)
+            if target is not None and target not in chain:
+                cached, target = self.cache.get_chain(target, query_type, 
+                    max_length=self.max_chain)
+                answers = extend_answers(answers, cached)
+            if target is not None and (target in chain or 
+                    len(chain) >= self.max_chain):
+                print('CNAME chain too long or looping: {0}'.format(
+                    request))
+                break
+        if self.metrics is not None:
+            self.metrics.observe('query_seconds', self.server, 
+                time.perf_counter() - start)
+
+        if len(answers) > 0:
             if debug_mode:
                 print('################################' \
                     '############################')
-            format.print_result()
-            self.socket.close()
-        elif not recursion_desired:
-            for rr in format.additional_RRs:
-                if self.connect_server(rr.resource_data.ip):
-                    ipv6 = (rr.type == 28)
-                    self.send_query(request, recursion_desired=False, 
-                        debug_mode=debug_mode, IPv6=ipv6)
+            print_answers(answers)
+        return answers
+
+    def query(self, request, query_type, recursion_desired=True):
+        '''query over udp, without EDNS after FORMERR and over tcp when
+        truncated, returns (server, responce) or (None, None)
+        '''
+        server, format, query, messageID = self.query_udp(request, 
+            query_type, recursion_desired, self.payload_size)
+        if format is not None and format.header.rcode == 1 and \
+                self.payload_size is not None:
+            if self.metrics is not None:
+                self.metrics.count('retries', server, reason='formerr')
+            server, format, query, messageID = self.query_udp(request, 
+                query_type, recursion_desired, None)
+        if format is not None and format.header.tc:
+            format = self.query_tcp(server, query, messageID, format)
+        return (server, format)
+
+    def query_tcp(self, server, query, messageID, truncated):
+        '''repeats truncated query over tcp, keeps truncated responce if
+        tcp fails
+        '''
+        if self.metrics is not None:
+            self.metrics.count('truncated', server)
+        try:
+            return self.tcp_pool.query(server, query, messageID)
+        except OSError:
+            print('TCP query failed: {0}'.format(server))
+            return truncated
+
+    def lookup(self, request, types=(1, 28), recursion_desired=True):
+        '''queries all record types at once, returns LookupResult,
+        non recursive lookups go through iterative resolver type by type
+        '''
+        if not recursion_desired:
+            return self.lookup_iterative(request, types)
+        result = LookupResult(request)
+        pending = {}
+        for query_type in types:
+            query_type = type_code(query_type)
+            entry = self.cache.get(request, query_type)
+            if entry is not None:
+                result.add(query_type, entry.rcode, entry.records)
+                continue
+            messageID = random.getrandbits(16)
+            while messageID in pending:
+                messageID = random.getrandbits(16)
+            pending[messageID] = (query_type, self.encoder.encode(request, 
+                query_type, recursion_desired, messageID, 
+                self.payload_size))
+        if len(pending) == 0 or len(self.servers) == 0:
+            return result
+        server = self.selector.rank(self.servers)[0]
+        start = time.monotonic()
+        responces = exchange_many(self.socket, server, 
+            dict((messageID, query) for messageID, (query_type, query) 
+                in pending.items()), 
+            self.scheduler.first_timeout(self.selector, [server]), 
+            self.port, max(self.payload_size or 0, 1024))
+        if len(responces) > 0:
+            self.selector.record_success(server, time.monotonic() - start)
+        for messageID, (query_type, query) in pending.items():
+            format = responces.get(messageID)
+            if format is not None and format.header.tc:
+                format = self.query_tcp(server, query, messageID, format)
+            if format is None or format.header.rcode not in (0, 3):
+                format = self.query(request, query_type, 
+                    recursion_desired)[1]
+            if format is None:
+                result.errors[query_type] = 'timeout'
+                continue
+            self.cache.store_response(request, query_type, 1, format)
+            result.add(query_type, format.header.rcode, format.answers)
+        return result
+
+    def query_udp(self, request, query_type, recursion_desired, 
+            payload_size):
+        '''query best servers, returns (server, responce, query, ID)
+        '''
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        messageID = random.getrandbits(16)
+        query = self.encoder.encode(request, query_type, recursion_desired, 
+            messageID, payload_size)
+        if metrics is not None:
+            metrics.observe('encode_seconds', None, 
+                time.perf_counter() - start)
+        buffer_size = max(payload_size or 0, 1024)
+        attempts = []
+        def send(servers, timeout):
+            if metrics is not None:
+                for server in servers:
+                    metrics.count('queries', server)
+                    if len(attempts) > 0:
+                        metrics.count('retries', server, reason='timeout')
+            attempts.append(servers)
+            server, format = exchange(self.socket, servers, query, 
+                messageID, timeout, self.port, buffer_size, metrics)
+            if metrics is not None and format is None:
+                for server in servers:
+                    metrics.count('timeouts', server)
+            return (server, format)
+        server, format = self.scheduler.query(self.selector, self.servers, 
+            send, self.fanout)
+        return (server, format, query, messageID)
+
+    def lookup_iterative(self, request, types):
+        '''resolves each record type from root hints, returns LookupResult
+        '''
+        result = LookupResult(request)
+        resolver = self.iterative_resolver()
+        for query_type in types:
+            query_type = type_code(query_type)
+            try:
+                answers = resolver.resolve(request, query_type)
+            except ResolveError as error:
+                result.errors[query_type] = str(error)
+                continue
+            entry = self.cache.find(make_key(request, query_type))
+            if entry is None:
+                result.add(query_type, 0, answers)
+            else:
+                result.add(query_type, entry.rcode, answers)
+        return result
+
+    def iterative_resolver(self):
+        '''iterative resolver sharing client cache, created on first use
+        '''
+        if self.resolver is None:
+            self.resolver = IterativeResolver(cache=self.cache, 
+                fanout=self.fanout, payload_size=self.payload_size)
+        return self.resolver
+
+    def send_iterative(self, request, query_type, debug_mode=False):
+        '''resolve from root hints following referrals
+        '''
+        resolver = self.iterative_resolver()
+        resolver.debug_mode = debug_mode
+        try:
+            answers = resolver.resolve(request, query_type)
+        except ResolveError as error:
+            print(error)
+            return []
+        if debug_mode and len(answers) > 0:
+            print('################################' \
+                '############################')
+        print_answers(answers)
+        return answers
 
     def disconnect(self):
         '''disconnect
         '''
         self.socket.close()
+        self.tcp_pool.close()
+        if self.resolver is not None:
+            self.resolver.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,162 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+columnar decode of many responces for analytics
+'''
+import socket
+import struct
+from array import array
+from query import decode_string, skip_name, header_struct, \
+    question_struct, rr_struct
+
+
+mapped_prefix = b'\x00' * 10 + b'\xff\xff'
+no_address = b'\x00' * 16
+
+
+class ResponseTable:
+    '''flat columns of decoded messages and their answers, one row per
+    message and one per answer record, names are interned and stored
+    as indexes into names, answer_addresses holds 16 bytes per answer
+    (A as IPv4-mapped, zeros when rdata is no address, see
+    answer_lengths), columns are array module buffers, e.g.
+    numpy.frombuffer(table.answer_ttls, 'u4') wraps one without copy
+    '''
+
+
+    def __init__(self):
+        self.names = ['']
+        self.name_index = { '':0 }
+        self.message_ids = array('H')
+        self.flags = array('H')
+        self.rcodes = array('B')
+        self.qnames = array('I')
+        self.qtypes = array('H')
+        self.answer_messages = array('I')
+        self.answer_names = array('I')
+        self.answer_types = array('H')
+        self.answer_ttls = array('I')
+        self.answer_lengths = array('H')
+        self.answer_addresses = bytearray()
+        self.malformed = 0
+
+    def __len__(self):
+        return len(self.message_ids)
+
+    def intern(self, name):
+        '''index of name in names
+        '''
+        index = self.name_index.get(name)
+        if index is None:
+            index = self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def add(self, message):
+        '''decodes header, first question and answers of raw message,
+        raises ValueError and keeps no rows of undecodable message
+        '''
+        answers = len(self.answer_types)
+        try:
+            self.decode(message)
+        except (IndexError, ValueError, struct.error) as error:
+            del self.answer_messages[answers:]
+            del self.answer_names[answers:]
+            del self.answer_types[answers:]
+            del self.answer_ttls[answers:]
+            del self.answer_lengths[answers:]
+            del self.answer_addresses[16 * answers:]
+            raise ValueError('Malformed message: {0}'.format(error))
+
+    def decode(self, message):
+        '''appends rows of message, answer rows first
+        '''
+        if len(message) < 12:
+            raise ValueError('Truncated message')
+        messageID, meta, qd_count, an_count, ns_count, ar_count = \
+            header_struct.unpack_from(message, 0)
+        names = {}
+        row = len(self.message_ids)
+        qname = 0
+        qtype = 0
+        offset = 12
+        for i in range(qd_count):
+            if i == 0:
+                offset, name = decode_string(message, offset, names)
+                qname = self.intern(name)
+                qtype = question_struct.unpack_from(message, offset)[0]
+            else:
+                offset = skip_name(message, offset)
+            offset += question_struct.size
+        intern = self.intern
+        addresses = self.answer_addresses
+        pointers = {}
+        for i in range(an_count):
+            if message[offset] >= 192:
+                target = ((message[offset] & 63) << 8) | message[offset + 1]
+                name = pointers.get(target)
+                if name is None:
+                    name = pointers[target] = intern(decode_string(message, 
+                        offset, names)[1])
+                offset += 2
+            else:
+                offset, name = decode_string(message, offset, names)
+                name = intern(name)
+            type, request_class, ttl, length = rr_struct.unpack_from(
+                message, offset)
+            offset += rr_struct.size
+            if offset + length > len(message):
+                raise ValueError('Truncated record')
+            if type == 1 and length == 4:
+                addresses += mapped_prefix
+                addresses += message[offset:offset + 4]
+            elif type == 28 and length == 16:
+                addresses += message[offset:offset + 16]
+            else:
+                addresses += no_address
+            offset += length
+            self.answer_messages.append(row)
+            self.answer_names.append(name)
+            self.answer_types.append(type)
+            self.answer_ttls.append(ttl)
+            self.answer_lengths.append(length)
+        self.message_ids.append(messageID)
+        self.flags.append(meta)
+        self.rcodes.append(meta & 15)
+        self.qnames.append(qname)
+        self.qtypes.append(qtype)
+
+    def extend(self, messages):
+        '''adds raw messages from iterable, counts and skips undecodable
+        ones, returns number added
+        '''
+        added = len(self.message_ids)
+        for message in messages:
+            try:
+                self.add(message)
+            except ValueError:
+                self.malformed += 1
+        return len(self.message_ids) - added
+
+    def address(self, row):
+        '''text address of A or AAAA answer row, None for other types
+        and for rows whose rdata has the wrong length
+        '''
+        type = self.answer_types[row]
+        length = self.answer_lengths[row]
+        packed = bytes(self.answer_addresses[16 * row:16 * row + 16])
+        if type == 1 and length == 4:
+            return socket.inet_ntoa(packed[12:16])
+        elif type == 28 and length == 16:
+            return socket.inet_ntop(socket.AF_INET6, packed)
+        return None
+
+    def answers(self):
+        '''yields (qname, qtype, rcode, name, type, ttl, address) rows
+        '''
+        names = self.names
+        for row in range(len(self.answer_types)):
+            message = self.answer_messages[row]
+            yield (names[self.qnames[message]], self.qtypes[message],
+                self.rcodes[message], names[self.answer_names[row]],
+                self.answer_types[row], self.answer_ttls[row],
+                self.address(row))
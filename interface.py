@@ -3,7 +3,75 @@ Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
 DNS Console interface
 '''
 from client import DNSClient
+from servers import RetryScheduler
+from metrics import Metrics
+from batch import resolve_batch
+from pool import resolve_pool
+from cache import DNSCache
+from snapshot import load_snapshot, save_snapshot
+from query import type_code
 import argparse
+import sys
+
+
+def parse_arguments(args=None):
+    '''parsed command line, exits with usage on errors
+    '''
+    parser = argparse.ArgumentParser(
+        description='DNS client application')
+    parser.add_argument('host_name', nargs='?', 
+        metavar='name', help='Host name to request')
+    parser.add_argument('--debug', '-d', action='store_true', 
+        help='Debug mode')
+    parser.add_argument('--nonrecursive', '-n', 
+        action='store_false', help='Non recursive mode')
+    parser.add_argument('--server', '-s', action='append', 
+        metavar='server_IP', 
+        help='Non-default DNS server, repeat for several')
+    parser.add_argument('--fanout', '-f', type=int, default=1, 
+        help='Query this many fastest servers in parallel')
+    parser.add_argument('--batch', '-b', metavar='file', 
+        help='Resolve names from file, one per line (- for stdin)')
+    parser.add_argument('--concurrency', '-c', type=int, default=100, 
+        help='Queries in flight in batch mode')
+    parser.add_argument('--timeout', '-t', type=float, default=5, 
+        help='Per-query time budget including retries, seconds')
+    parser.add_argument('--json', '-j', action='store_true', 
+        help='JSON lines output in batch mode')
+    parser.add_argument('--tcp', action='store_true', 
+        help='Pipeline batch queries over one TCP connection')
+    parser.add_argument('--processes', '-P', type=int, 
+        help='Shard batch names across this many worker processes')
+    parser.add_argument('--type', '-T', action='append', metavar='TYPE', 
+        help='Record type to query, repeat to query several at once, ' \
+            'e.g. -T A -T AAAA')
+    parser.add_argument('--metrics', '-m', action='store_true', 
+        help='Print query metrics in Prometheus text format')
+    parser.add_argument('--cache-file', metavar='file', 
+        help='Load cache from file at start and save it at exit')
+
+    parsed = parser.parse_args(args)
+    if parsed.host_name is None and parsed.batch is None:
+        parser.error('host name or --batch is required')
+    if parsed.type is not None:
+        try:
+            parsed.type = [type_code(type) for type in parsed.type]
+        except ValueError as error:
+            parser.error(str(error))
+    if parsed.batch is not None:
+        for option, unsupported in [
+                ('several --server', parsed.server is not None and 
+                    len(parsed.server) > 1), 
+                ('several --type', parsed.type is not None and 
+                    len(parsed.type) > 1), 
+                ('--nonrecursive', not parsed.nonrecursive), 
+                ('--fanout', parsed.fanout != 1), 
+                ('--metrics', parsed.metrics), 
+                ('--cache-file', parsed.cache_file is not None)]:
+            if unsupported:
+                parser.error('{0} is not supported with --batch'.format(
+                    option))
+    return parsed
 
 
 class ClientInterface:
@@ -11,31 +79,70 @@ class ClientInterface:
     '''
 
 
-    def __init__(self):
-        parser = argparse.ArgumentParser(
-            description='DNS client application')
-        parser.add_argument('host_name', nargs=1, 
-            metavar='name', help='Host name to request')
-        parser.add_argument('--debug', '-d', action='store_true', 
-            help='Debug mode')
-        parser.add_argument('--nonrecursive', '-n', 
-            action='store_false', help='Non recursive mode')
-        parser.add_argument('--server', '-s', nargs=1, 
-            metavar='server_IP', help='Non-default DNS server')    
-
-        self.call_command(parser.parse_args())
+    def __init__(self, args=None):
+        parsed = parse_arguments(args)
+        self.call_command(parsed)
 
     def call_command(self, parsed):
         '''call command
         '''
+        if parsed.batch is not None:
+            self.call_batch(parsed)
+            return
+        metrics = None
+        if parsed.metrics:
+            metrics = Metrics()
+        scheduler = RetryScheduler(budget=parsed.timeout)
+        cache = DNSCache()
+        if parsed.cache_file is not None:
+            load_snapshot(cache, parsed.cache_file)
         if parsed.server is None:
-            dns_client = DNSClient()
+            dns_client = DNSClient(cache=cache, fanout=parsed.fanout, 
+                metrics=metrics, scheduler=scheduler)
+        else:
+            dns_client = DNSClient(server=parsed.server, cache=cache, 
+                fanout=parsed.fanout, metrics=metrics, scheduler=scheduler)
+        if parsed.type is not None:
+            dns_client.lookup(parsed.host_name, parsed.type, 
+                recursion_desired=parsed.nonrecursive).print()
         else:
-            dns_client = DNSClient(server=parsed.server[0])
-        dns_client.send_query(parsed.host_name[0], 
-            recursion_desired=parsed.nonrecursive, 
-            debug_mode=parsed.debug)
+            dns_client.send_query(parsed.host_name, 
+                recursion_desired=parsed.nonrecursive, 
+                debug_mode=parsed.debug)
         dns_client.disconnect()
+        if parsed.cache_file is not None:
+            save_snapshot(cache, parsed.cache_file)
+        if metrics is not None:
+            print(metrics.prometheus(), end='')
+
+    def call_batch(self, parsed):
+        '''batch mode
+        '''
+        if parsed.server is None:
+            server = '8.8.8.8'
+        else:
+            server = parsed.server[0]
+        if parsed.type is None:
+            type = 1
+        else:
+            type = parsed.type[0]
+        if parsed.batch == '-':
+            stream = sys.stdin
+        else:
+            stream = open(parsed.batch)
+        try:
+            if parsed.processes is not None:
+                resolve_pool(stream, server=server, 
+                    processes=parsed.processes, 
+                    concurrency=parsed.concurrency, timeout=parsed.timeout, 
+                    json_output=parsed.json, type=type, tcp=parsed.tcp)
+            else:
+                resolve_batch(stream, server=server, 
+                    concurrency=parsed.concurrency, timeout=parsed.timeout, 
+                    json_output=parsed.json, type=type, tcp=parsed.tcp)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
 
 
 if __name__ == '__main__':
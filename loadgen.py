@@ -0,0 +1,124 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+open loop load generator for end-to-end throughput tests
+'''
+import argparse
+import asyncio
+import time
+from async_client import AsyncDNSClient
+from batch import read_names, percentile
+from cache import DNSCache
+
+
+class LoadGenerator:
+    '''sends queries at fixed rate regardless of responces, each one
+    straight upstream (query_upstream) or, with resolve, through the
+    client cache, coalescing and CNAME chasing (resolve)
+    '''
+
+
+    def __init__(self, client, names, qps=1000, duration=10, type=1,
+            tick=0.001, resolve=False):
+        self.client = client
+        self.names = list(names)
+        if len(self.names) == 0:
+            raise ValueError('No names to query')
+        self.resolve = resolve
+        self.qps = qps
+        self.duration = duration
+        self.type = type
+        self.tick = tick
+        self.latencies = []
+        self.sent = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    async def one(self, name):
+        '''one query, records latency or failure
+        '''
+        start = time.perf_counter()
+        try:
+            if self.resolve:
+                await self.client.resolve(name, self.type)
+            else:
+                await self.client.query_upstream(name, self.type)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return
+        except Exception:
+            self.errors += 1
+            return
+        self.latencies.append(time.perf_counter() - start)
+
+    async def run(self):
+        '''sends qps * duration queries on schedule, returns elapsed
+        seconds until the last responce
+        '''
+        loop = asyncio.get_running_loop()
+        total = int(self.qps * self.duration)
+        tasks = []
+        start = loop.time()
+        try:
+            while self.sent < total:
+                due = min(total, int((loop.time() - start) * self.qps) + 1)
+                while self.sent < due:
+                    tasks.append(asyncio.ensure_future(self.one(
+                        self.names[self.sent % len(self.names)])))
+                    self.sent += 1
+                await asyncio.sleep(self.tick)
+            await asyncio.gather(*tasks)
+        finally:
+            self.client.close()
+        return loop.time() - start
+
+    def summary(self, elapsed):
+        '''achieved rate and latency summary
+        '''
+        latencies = sorted(self.latencies)
+        if elapsed > 0:
+            rate = len(latencies) / elapsed
+        else:
+            rate = 0.0
+        return ('{0} sent, {1} answered, {2} timeouts, {3} errors, ' \
+            '{4:.1f} of {5} q/s, latency p50 {6:.2f}ms p99 {7:.2f}ms ' \
+            'max {8:.2f}ms').format(self.sent, len(latencies),
+                self.timeouts, self.errors, rate, self.qps,
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000,
+                percentile(latencies, 1.0) * 1000)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Open loop DNS load generator')
+    parser.add_argument('names_file', help='Names to query, one per line')
+    parser.add_argument('--server', '-s', default='127.0.0.1',
+        help='Server address')
+    parser.add_argument('--port', '-p', type=int, default=5353,
+        help='Server port')
+    parser.add_argument('--qps', '-q', type=float, default=1000,
+        help='Target queries per second')
+    parser.add_argument('--duration', '-d', type=float, default=10,
+        help='Seconds to send for')
+    parser.add_argument('--timeout', '-t', type=float, default=2,
+        help='Timeout per query in seconds')
+    parser.add_argument('--tcp', action='store_true',
+        help='Send queries over TCP')
+    parser.add_argument('--resolve', '-r', action='store_true',
+        help='Go through client cache and query coalescing')
+    parser.add_argument('--cache-size', type=int, default=0,
+        help='Client cache entries with --resolve')
+    parsed = parser.parse_args()
+
+    with open(parsed.names_file) as names_file:
+        names = list(read_names(names_file))
+    client = AsyncDNSClient(server=parsed.server, port=parsed.port,
+        timeout=parsed.timeout, cache=DNSCache(max_size=parsed.cache_size), 
+        tcp=parsed.tcp)
+    try:
+        generator = LoadGenerator(client, names, parsed.qps, parsed.duration, 
+            resolve=parsed.resolve)
+    except ValueError as error:
+        parser.error(str(error))
+    elapsed = asyncio.run(generator.run())
+    print(generator.summary(elapsed))
@@ -0,0 +1,114 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+query counters and latency histograms, Prometheus text export
+'''
+import bisect
+
+
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5)
+
+
+def format_labels(server, labels):
+    '''prometheus label set
+    '''
+    pairs = list(labels)
+    if server is not None:
+        pairs.insert(0, ('server', server))
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(key, value)
+        for key, value in pairs) + '}'
+
+
+class Histogram:
+    '''cumulative bucket counts of observed values
+    '''
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        '''add value
+        '''
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    '''counters and per-server histograms, callback(name, server, value,
+    labels) is called on every event
+    '''
+
+
+    def __init__(self, buckets=default_buckets, callback=None,
+            prefix='dns_client_'):
+        self.buckets = tuple(sorted(buckets))
+        self.callback = callback
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, server=None, **labels):
+        '''increment counter
+        '''
+        key = (name, server, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + 1
+        if self.callback is not None:
+            self.callback(name, server, 1, labels)
+
+    def observe(self, name, server, seconds):
+        '''add timing to histogram of server
+        '''
+        histogram = self.histograms.get((name, server))
+        if histogram is None:
+            histogram = Histogram(self.buckets)
+            self.histograms[(name, server)] = histogram
+        histogram.observe(seconds)
+        if self.callback is not None:
+            self.callback(name, server, seconds, {})
+
+    def counter(self, name, server=None, **labels):
+        '''current counter value
+        '''
+        return self.counters.get((name, server,
+            tuple(sorted(labels.items()))), 0)
+
+    def prometheus(self):
+        '''text exposition format
+        '''
+        lines = []
+        last = None
+        for (name, server, labels), value in sorted(self.counters.items(),
+                key=lambda item: (item[0][0], item[0][1] or '', item[0][2])):
+            metric = self.prefix + name + '_total'
+            if name != last:
+                lines.append('# TYPE {0} counter'.format(metric))
+                last = name
+            lines.append('{0}{1} {2}'.format(metric,
+                format_labels(server, labels), value))
+        last = None
+        for (name, server), histogram in sorted(self.histograms.items(),
+                key=lambda item: (item[0][0], item[0][1] or '')):
+            metric = self.prefix + name
+            if name != last:
+                lines.append('# TYPE {0} histogram'.format(metric))
+                last = name
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',),
+                    histogram.counts):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(metric,
+                    format_labels(server, [('le', bound)]), cumulative))
+            lines.append('{0}_sum{1} {2}'.format(metric,
+                format_labels(server, []), histogram.sum))
+            lines.append('{0}_count{1} {2}'.format(metric,
+                format_labels(server, []), histogram.count))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,197 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+bulk resolution sharded across worker processes
+'''
+import asyncio
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import zlib
+from async_client import AsyncDNSClient
+from batch import BatchResolver, read_names, format_result, summarize
+from cache import normalize_name
+
+
+def shard(name, processes):
+    '''worker index of name, stable across processes
+    '''
+    return zlib.crc32(normalize_name(name).encode('utf-8')) % processes
+
+
+class ShardResolver(BatchResolver):
+    '''worker side resolver, sends results to parent in chunks of
+    (name, addresses, elapsed, error) tuples
+    '''
+
+
+    def __init__(self, client, results, concurrency=100,
+            recursion_desired=True, chunk_size=64):
+        super().__init__(client, concurrency,
+            recursion_desired=recursion_desired)
+        self.results = results
+        self.chunk_size = chunk_size
+        self.chunk = []
+
+    def write_result(self, name, addresses, elapsed, error):
+        '''buffer result, flush full chunk
+        '''
+        self.chunk.append((name, tuple(addresses), elapsed, error))
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''send buffered results to parent
+        '''
+        if len(self.chunk) > 0:
+            self.results.put(self.chunk)
+            self.chunk = []
+
+    async def run_chunks(self, chunks, type=1):
+        '''resolves chunks of names taken from chunks queue until None,
+        next chunk is fetched while current one resolves
+        '''
+        loop = asyncio.get_running_loop()
+        try:
+            chunk = await loop.run_in_executor(None, chunks.get)
+            while chunk is not None:
+                following = loop.run_in_executor(None, chunks.get)
+                names = iter(chunk)
+                await asyncio.gather(*[self.worker(names, type)
+                    for i in range(self.concurrency)])
+                chunk = await following
+        finally:
+            self.client.close()
+
+
+def resolve_shard(chunks, results, server, port, timeout, concurrency,
+        recursion_desired, type, tcp):
+    '''worker process entry point, own socket and cache, resolves chunks
+    of names until None, None marks end of results
+    '''
+    client = AsyncDNSClient(server=server, port=port, timeout=timeout,
+        tcp=tcp)
+    resolver = ShardResolver(client, results, concurrency,
+        recursion_desired)
+    try:
+        asyncio.run(resolver.run_chunks(chunks, type))
+        resolver.flush()
+    finally:
+        results.put(None)
+
+
+class ResolverPool:
+    '''shards names across processes by name hash, names are read from
+    the iterator and sent in chunks as they come, results are written as
+    they arrive
+    '''
+
+
+    def __init__(self, server='8.8.8.8', processes=None, concurrency=100,
+            timeout=5, json_output=False, output=sys.stdout,
+            recursion_desired=True, tcp=False, port=53, chunk_size=256,
+            queued_chunks=4):
+        if processes is None:
+            processes = os.cpu_count() or 1
+        self.processes = max(processes, 1)
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.json_output = json_output
+        self.output = output
+        self.recursion_desired = recursion_desired
+        self.tcp = tcp
+        self.chunk_size = chunk_size
+        self.queued_chunks = queued_chunks
+        self.latencies = []
+        self.errors = 0
+        self.finished = 0
+
+    def write_result(self, name, addresses, elapsed, error):
+        '''streams one result line
+        '''
+        print(format_result(name, addresses, elapsed, error,
+            self.json_output), file=self.output)
+
+    def collect(self, results, timeout):
+        '''writes one chunk of results arriving within timeout, returns
+        False when none arrived
+        '''
+        try:
+            chunk = results.get(True, timeout)
+        except queue.Empty:
+            return False
+        if chunk is None:
+            self.finished += 1
+            return True
+        for name, addresses, elapsed, error in chunk:
+            self.latencies.append(elapsed)
+            if error is not None:
+                self.errors += 1
+            self.write_result(name, addresses, elapsed, error)
+        return True
+
+    def feed(self, worker, chunks, chunk, results):
+        '''hands chunk to worker, writes results while its queue is full
+        '''
+        while worker.is_alive():
+            try:
+                chunks.put(chunk, timeout=0.05)
+                return
+            except queue.Full:
+                while self.collect(results, 0):
+                    pass
+
+    def run(self, names, type=1):
+        '''resolves all names, returns elapsed seconds
+        '''
+        start = time.perf_counter()
+        self.finished = 0
+        results = multiprocessing.Queue()
+        inputs = [multiprocessing.Queue(self.queued_chunks)
+            for i in range(self.processes)]
+        workers = [multiprocessing.Process(target=resolve_shard,
+            args=(chunks, results, self.server, self.port, self.timeout,
+                self.concurrency, self.recursion_desired, type, self.tcp),
+            daemon=True) for chunks in inputs]
+        for worker in workers:
+            worker.start()
+        pending = [[] for i in range(self.processes)]
+        for name in names:
+            index = shard(name, self.processes)
+            pending[index].append(name)
+            if len(pending[index]) >= self.chunk_size:
+                self.feed(workers[index], inputs[index], pending[index],
+                    results)
+                pending[index] = []
+        for index, worker in enumerate(workers):
+            if len(pending[index]) > 0:
+                self.feed(worker, inputs[index], pending[index], results)
+            self.feed(worker, inputs[index], None, results)
+        while self.finished < len(workers):
+            if not self.collect(results, 1) and \
+                    not any(worker.is_alive() for worker in workers):
+                break
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - start
+
+    def summary(self, elapsed):
+        '''throughput and latency summary
+        '''
+        return summarize(self.latencies, self.errors, elapsed)
+
+
+def resolve_pool(stream, server='8.8.8.8', processes=None, concurrency=100,
+        timeout=5, recursion_desired=True, json_output=False, type=1,
+        tcp=False):
+    '''resolves names from stream in worker processes, prints results
+    and summary
+    '''
+    pool = ResolverPool(server, processes, concurrency, timeout,
+        json_output, recursion_desired=recursion_desired, tcp=tcp)
+    elapsed = pool.run(read_names(stream), type)
+    print(pool.summary(elapsed), file=sys.stderr)
+    return pool
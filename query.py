@@ -4,6 +4,15 @@ dns message structures
 '''
 import struct
 import random
+import socket
+
+
+header_struct = struct.Struct('>HHHHHH')
+short_struct = struct.Struct('>H')
+question_struct = struct.Struct('>HH')
+rr_struct = struct.Struct('>HHIH')
+soa_struct = struct.Struct('>IIIII')
+srv_struct = struct.Struct('>HHH')
 
 
 def pack(value):
@@ -16,29 +25,117 @@ def unpack(data):
     '''
     return struct.unpack('>H', data)[0]
 
-def decode_string(message, offset):
-    '''decodes string
+def decode_string(message, offset, names=None):
+    '''decodes string, names caches decoded suffixes by offset
     '''
     index = offset
-    result = ''
+    limit = offset
+    labels = []
+    starts = []
+    suffix = None
     offset = 0
-    while message[index] != 0:
+    while True:
         value = message[index]
-        if (value>>6) == 3:
-            next = unpack(message[index:index + 2])
+        if value == 0:
+            break
+        if value >= 192:
             if offset == 0:
                 offset = index + 2
-            index = next ^ (3<<14)
+            next = ((value & 63) << 8) | message[index + 1]
+            if next >= limit:
+                raise ValueError('Bad compression pointer')
+            index = limit = next
+            if names is not None and index in names:
+                suffix = names[index]
+                break
+        elif value > 63:
+            raise ValueError('Bad label length')
         else:
-            result += message[index + 1:index + 1 + 
-                    value].decode('utf-8') + '.'
+            starts.append(index)
+            labels.append(str(message[index + 1:index + 1 + value], 
+                'utf-8'))
             index += value + 1
     if offset == 0:
         offset = index + 1
-    result = result[:-1]
+    if suffix is not None:
+        labels.append(suffix)
+    result = '.'.join(labels)
+    if names is not None:
+        for i in range(len(starts)):
+            names[starts[i]] = '.'.join(labels[i:])
     return (offset, result)
 
-query_type_names = { 1:'A', 2:'NS', 5:'CNAME', 15:'MX', 28:'AAAA' }
+def skip_name(message, offset):
+    '''offset after name without decoding it
+    '''
+    while True:
+        length = message[offset]
+        if length >= 192:
+            return offset + 2
+        if length > 63:
+            raise ValueError('Bad label length')
+        if length == 0:
+            return offset + 1
+        offset += length + 1
+
+def encode_name(name):
+    '''encodes name without compression
+    '''
+    if name.endswith('.'):
+        name = name[:-1]
+    result = bytearray()
+    if name:
+        for domain_name in name.split('.'):
+            label = bytes(domain_name, 'utf-8')
+            result.append(len(label))
+            result += label
+    result.append(0)
+    return bytes(result)
+
+def encode_rr(name, type, request_class, ttl, rdata):
+    '''encodes resource record with raw rdata
+    '''
+    return encode_name(name) + rr_struct.pack(type, request_class, ttl, 
+        len(rdata)) + rdata
+
+def encode_opt(payload_size, dnssec_ok=False):
+    '''EDNS(0) OPT pseudo-record advertising udp payload size
+    '''
+    if dnssec_ok:
+        flags = 1<<15
+    else:
+        flags = 0
+    return b'\x00' + rr_struct.pack(41, payload_size, flags, 0)
+
+def answer_addresses(answers, raw=False):
+    '''A and AAAA addresses of answer records, packed bytes when raw
+    '''
+    if raw:
+        return [answer.resource_data.packed for answer in answers
+            if answer.type == 1 or answer.type == 28]
+    return [answer.resource_data.ip for answer in answers
+        if answer.type == 1 or answer.type == 28]
+
+def type_code(type):
+    '''record type number from number or name like 'AAAA'
+    '''
+    if isinstance(type, str):
+        if type.isdigit():
+            return int(type)
+        if type.upper() not in type_codes:
+            raise ValueError('Unknown record type {0}'.format(type))
+        return type_codes[type.upper()]
+    return type
+
+def print_answers(answers):
+    '''prints addresses from answer records
+    '''
+    for address in answer_addresses(answers):
+        print(address)
+
+query_type_names = { 1:'A', 2:'NS', 5:'CNAME', 6:'SOA', 15:'MX', 16:'TXT', 
+28:'AAAA', 33:'SRV', 41:'OPT' }
+type_codes = dict((name, code) for code, name in query_type_names.items())
 opcodes = { 0:'QUERY', 1:'IQUERY', 2:'STATUS' }
 query_class_names = { 1:'IN' }
 message_types = { 0:'QUERY', 1:'RESPONSE' }
@@ -50,12 +147,15 @@ class MessageHeader:
     '''message header class
     '''
 
+    __slots__ = ('messageID', 'qr', 'opcode', 'aa', 'tc', 'rd', 'ra', 'rcode', 
+        'qd_count', 'an_count', 'ns_count', 'ar_count')
 
     def decode(self, message):
         '''decode header
         '''
-        self.messageID = unpack(message[0:2])
-        meta = unpack(message[2:4])
+        (self.messageID, meta, self.qd_count, self.an_count, 
+            self.ns_count, self.ar_count) = header_struct.unpack_from(
+                message, 0)
         self.rcode = (meta & 15)
         meta >>= 7
         self.ra = (meta & 1)
@@ -69,10 +169,6 @@ class MessageHeader:
         self.opcode = (meta & 15)
         meta >>= 4
         self.qr = meta
-        self.qd_count = unpack(message[4:6])
-        self.an_count = unpack(message[6:8])
-        self.ns_count = unpack(message[8:10])
-        self.ar_count = unpack(message[10:12])
         return 12
 
     def generate_ID(self):
@@ -102,7 +198,6 @@ class MessageHeader:
     def encode(self):
         '''encode header
         '''
-        result = pack(self.messageID)
         meta = 0
         meta |= self.qr
         meta <<= 1
@@ -117,12 +212,8 @@ class MessageHeader:
         meta |= self.ra
         meta <<= 7
         meta |= self.rcode
-        result += pack(meta)
-        result += pack(self.qd_count)
-        result += pack(self.an_count)
-        result += pack(self.ns_count)
-        result += pack(self.ar_count)
-        return result
+        return header_struct.pack(self.messageID, meta, self.qd_count, 
+            self.an_count, self.ns_count, self.ar_count)
 
     def print(self):
         '''for debug mode
@@ -147,23 +238,26 @@ class DNSQuestion:
     '''dns question class
     '''
 
+    __slots__ = ('name', 'type', 'request_class')
 
-    def decode(self, message, offset):
+    def decode(self, message, offset, names=None):
         '''decode question
         '''
-        name = decode_string(message, offset)
+        name = decode_string(message, offset, names)
         offset = name[0]
         self.name = name[1]
-        self.type = unpack(message[offset:offset + 2])
-        self.request_class = unpack(message[offset + 2:offset + 4])
+        self.type, self.request_class = question_struct.unpack_from(
+            message, offset)
         return offset + 4
     
 
-    def set_question(self, name, IPv6):
+    def set_question(self, name, IPv6, query_type=None):
         '''set question
         '''
         self.name = name
-        if IPv6:
+        if query_type is not None:
+            self.type = query_type
+        elif IPv6:
             self.type = 28
         else:
             self.type = 1
@@ -172,41 +266,49 @@ class DNSQuestion:
     def encode_name(self):
         '''encode question name
         '''
-        name = self.name
-        if name.endswith('.'):
-            name = name[:-1]
-        result = b''
-        for domain_name in name.split('.'):
-            result += struct.pack('B', len(domain_name))
-            result += bytes(domain_name, 'utf-8')
-        result += b'\x00'
-        return result
+        return encode_name(self.name)
 
     def encode(self):
         '''encode question
         '''
-        result = self.encode_name()
-        result += pack(self.type)
-        result += pack(self.request_class)
-        return result
+        return self.encode_name() + question_struct.pack(self.type, 
+            self.request_class)
 
     def print(self):
         '''for debug mode
         '''
         print('    Name: {0}'.format(self.name))
-        print('    Type: {0}'.format(query_type_names[self.type]))
-        print('    Class: {0}'.format(query_class_names[self.request_class]))
+        print('    Type: {0}'.format(query_type_names.get(self.type, 
+            self.type)))
+        print('    Class: {0}'.format(query_class_names.get(
+            self.request_class, self.request_class)))
 
 
 class AResourceData:
-    '''resource data class
+    '''resource data class, address is kept packed and formatted on access
     '''
 
+    __slots__ = ('packed',)
 
     def __init__(self, data):
-        ip = struct.unpack('BBBB', data)
-        self.ip = str(ip[0]) + '.' + str(ip[1]) + \
-                '.' + str(ip[2]) + '.' + str(ip[3])
+        self.packed = bytes(data)
+
+    @property
+    def ip(self):
+        '''dotted quad
+        '''
+        return socket.inet_ntoa(self.packed)
+
+    @property
+    def integer(self):
+        '''address as int
+        '''
+        return int.from_bytes(self.packed, 'big')
+
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        return self.packed
 
     def print(self):
         '''for debug mode
@@ -214,32 +316,41 @@ class AResourceData:
         print('    A: {0}'.format(self.ip))
 
 class AAAAResourceData:
-    '''resource data class
+    '''resource data class, address is kept packed and formatted on access
     '''
 
+    __slots__ = ('packed',)
+
+    def __init__(self, data):
+        self.packed = bytes(data)
+
+    @property
+    def ip(self):
+        '''canonical text form (RFC 5952)
+        '''
+        return socket.inet_ntop(socket.AF_INET6, self.packed)
+
+    @property
+    def data(self):
+        '''packed address, read-only alias kept for older callers
+        '''
+        return self.packed
+
+    @property
+    def integer(self):
+        '''address as int
+        '''
+        return int.from_bytes(self.packed, 'big')
 
     def hexdump(self, data):
         '''dump data
         '''
-        result = ''
-        for byte in data:
-            result += str(hex(256 + byte))[3:]
-        return result 
+        return bytes(data).hex()
 
-    def __init__(self, data):
-        self.data = data
-        self.ip = ''
-        dump = self.hexdump(data)
-        for i in range(8):
-            value = dump[i*4:i*4 + 4]
-            for i in range(4):
-                if value[i] != '0':
-                    value = value[i:]
-                    break
-                if i == 3:
-                    value = ''
-            self.ip += value + ':'
-        self.ip = self.ip[:-1]
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        return self.packed
 
     def print(self):
         '''for debug mode
@@ -251,9 +362,15 @@ class NSResourceData:
     '''resource data class
     '''
 
-    
-    def __init__(self, message, offset):
-        self.name = decode_string(message, offset)[1]
+    __slots__ = ('name',)
+
+    def __init__(self, message, offset, names=None):
+        self.name = decode_string(message, offset, names)[1]
+
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        return encode_name(self.name)
 
     def print(self):
         '''for debug mode
@@ -265,11 +382,18 @@ class MXResourceData:
     '''resource data class
     '''
 
+    __slots__ = ('preference', 'mail_exchanger')
 
-    def __init__(self, message, offset):
-        self.preference = unpack(message[offset:offset + 2])
+    def __init__(self, message, offset, names=None):
+        self.preference = short_struct.unpack_from(message, offset)[0]
         offset += 2
-        self.mail_exchanger = decode_string(message, offset)[1]
+        self.mail_exchanger = decode_string(message, offset, names)[1]
+
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        return short_struct.pack(self.preference) + \
+            encode_name(self.mail_exchanger)
 
     def print(self):
         '''for debug mode
@@ -282,9 +406,15 @@ class CNAMEResourceData:
     '''resource data class
     '''
 
+    __slots__ = ('name',)
 
-    def __init__(self, message, offset):
-        self.name = decode_string(message, offset)[1]
+    def __init__(self, message, offset, names=None):
+        self.name = decode_string(message, offset, names)[1]
+
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        return encode_name(self.name)
 
     def print(self):
         '''for debug mode
@@ -292,13 +422,139 @@ class CNAMEResourceData:
         print('    CNAME: {0}'.format(self.name))
 
 
+class SOAResourceData:
+    '''resource data class
+    '''
+
+    __slots__ = ('primary_name_server', 'responsible_mailbox', 'serial', 
+        'refresh', 'retry', 'expire', 'minimum')
+
+    def __init__(self, message, offset, names=None):
+        name = decode_string(message, offset, names)
+        offset = name[0]
+        self.primary_name_server = name[1]
+        name = decode_string(message, offset, names)
+        offset = name[0]
+        self.responsible_mailbox = name[1]
+        (self.serial, self.refresh, self.retry, self.expire, 
+            self.minimum) = soa_struct.unpack_from(message, offset)
+
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        return encode_name(self.primary_name_server) + \
+            encode_name(self.responsible_mailbox) + soa_struct.pack(
+                self.serial, self.refresh, self.retry, self.expire, 
+                self.minimum)
+
+    def print(self):
+        '''for debug mode
+        '''
+        print('    SOA: {0} {1} {2} {3} {4} {5} {6}'.format(
+                self.primary_name_server, self.responsible_mailbox, 
+                self.serial, self.refresh, self.retry, self.expire, 
+                self.minimum))
+
+
+class TXTResourceData:
+    '''resource data class
+    '''
+
+    __slots__ = ('strings',)
+
+    def __init__(self, data):
+        data = bytes(data)
+        self.strings = []
+        index = 0
+        while index < len(data):
+            length = data[index]
+            self.strings.append(str(data[index + 1:index + 1 + length], 
+                'utf-8', 'replace'))
+            index += length + 1
+
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        result = bytearray()
+        for string in self.strings:
+            string = bytes(string, 'utf-8')
+            result.append(len(string))
+            result += string
+        return bytes(result)
+
+    def print(self):
+        '''for debug mode
+        '''
+        print('    TXT: {0}'.format(' '.join('"{0}"'.format(string) 
+            for string in self.strings)))
+
+
+class SRVResourceData:
+    '''resource data class
+    '''
+
+    __slots__ = ('priority', 'weight', 'port', 'target')
+
+    def __init__(self, message, offset, names=None):
+        self.priority, self.weight, self.port = srv_struct.unpack_from(
+            message, offset)
+        self.target = decode_string(message, offset + 6, names)[1]
+
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        return srv_struct.pack(self.priority, self.weight, self.port) + \
+            encode_name(self.target)
+
+    def print(self):
+        '''for debug mode
+        '''
+        print('    SRV: {0} {1} {2} {3}'.format(self.priority, self.weight, 
+            self.port, self.target))
+
+
+class OPTResourceData:
+    '''resource data class
+    '''
+
+    __slots__ = ('options',)
+
+    def __init__(self, data):
+        self.options = []
+        offset = 0
+        while offset + 4 <= len(data):
+            code, length = question_struct.unpack_from(data, offset)
+            offset += 4
+            self.options.append((code, bytes(data[offset:offset + length])))
+            offset += length
+
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        result = b''
+        for code, data in self.options:
+            result += question_struct.pack(code, len(data)) + data
+        return result
+
+    def print(self):
+        '''for debug mode
+        '''
+        print('    Options: {0}'.format(self.options))
+
+
 class BinaryResourceData:
     '''resource data class
     '''
 
+    __slots__ = ('data',)
 
     def __init__(self, data):
-        self.data = data
+        self.data = bytes(data)
+
+    def encode(self):
+        '''uncompressed rdata
+        '''
+        return self.data
 
     def print(self):
         '''for debug mode
@@ -310,72 +566,149 @@ class ResourceRecord:
     '''resource record class
     '''
 
+    __slots__ = ('name', 'type', 'request_class', 'ttl', 'rd_length', 
+        'resource_data')
 
-    def set_resource_data(self, message, offset):
+    def set_resource_data(self, message, offset, names=None):
         '''set resource data
         '''
-        rdata = message[offset: offset + self.rd_length]
         if self.type == 1:
-            self.resource_data = AResourceData(rdata)
+            self.resource_data = AResourceData(
+                message[offset:offset + self.rd_length])
         elif self.type == 2:
-            self.resource_data = NSResourceData(message, offset)
+            self.resource_data = NSResourceData(message, offset, names)
         elif self.type == 5:
-            self.resource_data = CNAMEResourceData(message, offset)
+            self.resource_data = CNAMEResourceData(message, offset, names)
+        elif self.type == 6:
+            self.resource_data = SOAResourceData(message, offset, names)
         elif self.type == 15:
-            self.resource_data = MXResourceData(message, offset)
+            self.resource_data = MXResourceData(message, offset, names)
+        elif self.type == 16:
+            self.resource_data = TXTResourceData(
+                message[offset:offset + self.rd_length])
+        elif self.type == 33:
+            self.resource_data = SRVResourceData(message, offset, names)
         elif self.type == 28:
-            self.resource_data = AAAAResourceData(rdata)
+            self.resource_data = AAAAResourceData(
+                message[offset:offset + self.rd_length])
+        elif self.type == 41:
+            self.resource_data = OPTResourceData(
+                message[offset:offset + self.rd_length])
         else:
-            self.resource_data = BinaryResourceData(rdata)
+            self.resource_data = BinaryResourceData(
+                message[offset:offset + self.rd_length])
 
-    def decode(self, message, offset):
+    def decode(self, message, offset, names=None):
         '''decode rr
         '''
-        name = decode_string(message, offset)
+        name = decode_string(message, offset, names)
         offset = name[0]
         self.name = name[1]
-        self.type = unpack(message[offset:offset + 2])
-        offset += 2
-        self.request_class = unpack(message[offset:offset + 2])
-        offset += 2
-        self.ttl = struct.unpack('>I', message[offset: offset + 4])[0]
-        offset += 4
-        self.rd_length = unpack(message[offset:offset + 2])
-        offset += 2
-        self.set_resource_data(message, offset)
+        self.type, self.request_class, self.ttl, self.rd_length = \
+            rr_struct.unpack_from(message, offset)
+        offset += 10
+        self.set_resource_data(message, offset, names)
         return offset + self.rd_length
 
+    def encode(self):
+        '''encode rr without name compression
+        '''
+        return encode_rr(self.name, self.type, self.request_class, self.ttl, 
+            self.resource_data.encode())
+
     def print(self):
         '''for debug mode
         '''
         print('    Name: {0}'.format(self.name))
-        print('    Type: {0}'.format(query_type_names[self.type]))
-        print('    Class: {0}'.format(
-                query_class_names[self.request_class]))
-        print('    TTL: {0}'.format(self.ttl))
+        print('    Type: {0}'.format(query_type_names.get(self.type, 
+                self.type)))
+        if self.type == 41:
+            print('    UDP payload size: {0}'.format(self.request_class))
+            print('    Extended RCODE and flags: {0}'.format(
+                    hex(self.ttl)))
+        else:
+            print('    Class: {0}'.format(query_class_names.get(
+                    self.request_class, self.request_class)))
+            print('    TTL: {0}'.format(self.ttl))
         self.resource_data.print()
 
 
+class QueryTemplate:
+    '''preencoded query, only message ID changes between sends
+    '''
+
+    __slots__ = ('packet',)
+
+    def __init__(self, name, type, recursion_desired, payload_size=None):
+        header = MessageHeader()
+        header.set_question_header(recursion_desired)
+        question = DNSQuestion()
+        question.set_question(name, False, type)
+        if payload_size is None:
+            self.packet = bytearray(header.encode() + question.encode())
+        else:
+            header.ar_count = 1
+            self.packet = bytearray(header.encode() + question.encode() + 
+                encode_opt(payload_size))
+
+    def encode(self, messageID):
+        '''query with given ID
+        '''
+        short_struct.pack_into(self.packet, 0, messageID)
+        return bytes(self.packet)
+
+
+class QueryEncoder:
+    '''caches query templates per (name, type)
+    '''
+
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.templates = {}
+
+    def encode(self, name, type, recursion_desired, messageID, 
+            payload_size=None):
+        '''encode query, with OPT record when payload size is given
+        '''
+        key = (name, type, recursion_desired, payload_size)
+        template = self.templates.get(key)
+        if template is None:
+            if len(self.templates) >= self.max_size:
+                self.templates.clear()
+            template = QueryTemplate(name, type, recursion_desired, 
+                payload_size)
+            self.templates[key] = template
+        return template.encode(messageID)
+
+
 class DNSMessageFormat:
     '''dns message format class
     '''
 
 
-    def encode(self, host_name, recursion_desired, IPv6):
+    def encode(self, host_name, recursion_desired, IPv6, query_type=None, 
+            payload_size=None):
         '''encode message
         '''
         message = b''
         self.header = MessageHeader()
         self.header.set_question_header(recursion_desired)
+        if payload_size is not None:
+            self.header.ar_count = 1
         message += self.header.encode()
         self.question = DNSQuestion()
-        self.question.set_question(host_name, IPv6)
+        self.question.set_question(host_name, IPv6, query_type)
         message += self.question.encode()
+        if payload_size is not None:
+            message += encode_opt(payload_size)
         return message
 
     def decode(self, message):
         '''decode message
         '''
+        message = memoryview(message)
+        names = {}
         self.header = MessageHeader()
         offset = self.header.decode(message)
         self.questions = []
@@ -384,16 +717,19 @@ class DNSMessageFormat:
         self.additional_RRs = []
         for i in range(self.header.qd_count):
             self.questions.append(DNSQuestion())
-            offset = self.questions[i].decode(message, offset)
+            offset = self.questions[i].decode(message, offset, names)
         for i in range(self.header.an_count):
             self.answers.append(ResourceRecord())
-            offset = self.answers[i].decode(message, offset)
+            offset = self.answers[i].decode(message, offset, names)
         for i in range(self.header.ns_count):
             self.authority_RRs.append(ResourceRecord())
-            offset = self.authority_RRs[i].decode(message, offset)
+            offset = self.authority_RRs[i].decode(message, offset, names)
+        self.opt = None
         for i in range(self.header.ar_count):
             self.additional_RRs.append(ResourceRecord())
-            offset = self.additional_RRs[i].decode(message, offset)
+            offset = self.additional_RRs[i].decode(message, offset, names)
+            if self.additional_RRs[i].type == 41:
+                self.opt = self.additional_RRs[i]
 
     def print(self):
         '''for debug mode
@@ -416,6 +752,82 @@ class DNSMessageFormat:
     def print_result(self):
         '''output application result
         '''
-        for answer in self.answers:
-            if answer.type == 1 or answer.type == 28:
-                print(answer.resource_data.ip)
+        print_answers(self.answers)
+
+
+class LazySection:
+    '''records of one message section, each decoded on first access
+    '''
+
+    __slots__ = ('message', 'names', 'offsets', 'records', 'factory')
+
+    def __init__(self, message, names, offsets, factory):
+        self.message = message
+        self.names = names
+        self.offsets = offsets
+        self.records = [None] * len(offsets)
+        self.factory = factory
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        record = self.records[index]
+        if record is None:
+            record = self.factory()
+            record.decode(self.message, self.offsets[index], self.names)
+            self.records[index] = record
+        return record
+
+    def __iter__(self):
+        records = self.records
+        for i in range(len(records)):
+            record = records[i]
+            if record is None:
+                record = self.factory()
+                record.decode(self.message, self.offsets[i], self.names)
+                records[i] = record
+            yield record
+
+
+class LazyMessage(DNSMessageFormat):
+    '''message view, checks header and record boundaries on decode,
+    records are decoded when accessed
+    '''
+
+
+    def decode(self, message):
+        '''decode header, find record offsets
+        '''
+        message = memoryview(message)
+        names = {}
+        self.header = MessageHeader()
+        offset = self.header.decode(message)
+        offsets = []
+        for i in range(self.header.qd_count):
+            offsets.append(offset)
+            offset = skip_name(message, offset) + 4
+        self.questions = LazySection(message, names, offsets, DNSQuestion)
+        sections = []
+        opt_index = None
+        for count in (self.header.an_count, self.header.ns_count, 
+                self.header.ar_count):
+            offsets = []
+            for i in range(count):
+                offsets.append(offset)
+                offset = skip_name(message, offset)
+                type, request_class, ttl, rd_length = \
+                    rr_struct.unpack_from(message, offset)
+                if type == 41 and len(sections) == 2:
+                    opt_index = i
+                offset += 10 + rd_length
+            sections.append(LazySection(message, names, offsets, 
+                ResourceRecord))
+        if offset > len(message):
+            raise ValueError('Truncated message')
+        self.answers, self.authority_RRs, self.additional_RRs = sections
+        self.opt = None
+        if opt_index is not None:
+            self.opt = self.additional_RRs[opt_index]
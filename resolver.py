@@ -0,0 +1,219 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+iterative DNS resolver
+'''
+import os
+import random
+import socket
+from query import QueryEncoder
+from cache import DNSCache, DelegationCache, normalize_name, is_subdomain, \
+    chain_target, extend_answers, in_bailiwick
+from servers import ServerSelector, exchange
+from tcp import TCPConnectionPool
+
+
+root_hints_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'named.root')
+
+
+class ResolveError(Exception):
+    '''resolution failed
+    '''
+
+
+def read_root_hints(path=root_hints_path):
+    '''reads root server names and IPv4 addresses from hints file
+    '''
+    names = []
+    addresses = {}
+    with open(path) as hints:
+        for line in hints:
+            line = line.split(';')[0].split()
+            if len(line) < 3:
+                continue
+            if line[-2].upper() == 'NS':
+                names.append(normalize_name(line[-1]))
+            elif line[-2].upper() == 'A':
+                addresses.setdefault(normalize_name(line[0]), []).append(
+                    line[-1])
+    return names, addresses
+
+
+class IterativeResolver:
+    '''resolves names from root hints following referrals
+    '''
+
+
+    def __init__(self, cache=None, delegations=None, hints_path=None,
+            timeout=2, max_depth=8, max_queries=50, port=53,
+            debug_mode=False, selector=None, fanout=1, payload_size=1232):
+        if cache is None:
+            cache = DNSCache()
+        if delegations is None:
+            delegations = DelegationCache()
+        if selector is None:
+            selector = ServerSelector(max_timeout=timeout)
+        self.cache = cache
+        self.delegations = delegations
+        self.selector = selector
+        self.fanout = fanout
+        self.payload_size = payload_size
+        self.tcp_pool = TCPConnectionPool(port=port, timeout=timeout)
+        self.max_depth = max_depth
+        self.max_queries = max_queries
+        self.port = port
+        self.debug_mode = debug_mode
+        self.encoder = QueryEncoder()
+        self.socket = None
+        self.queries_left = 0
+        if hints_path is None:
+            hints_path = root_hints_path
+        names, addresses = read_root_hints(hints_path)
+        self.delegations.put('', names, addresses, float('inf'))
+
+    def resolve(self, name, type=1):
+        '''resolve name, returns answer records
+        '''
+        self.queries_left = self.max_queries
+        return self.lookup(normalize_name(name), type, 0)
+
+    def lookup(self, name, type, depth):
+        '''resolve name within current query budget
+        '''
+        if depth > self.max_depth:
+            raise ResolveError('Delegation depth exceeded for {0}'.format(
+                name))
+        records, target = self.cache.get_chain(name, type)
+        if target is None:
+            return records
+        if target != name:
+            return extend_answers(records, self.lookup(target, type, 
+                depth + 1))
+        delegation = self.delegations.find(name)
+        while True:
+            format = self.ask_delegation(delegation, name, type, depth)
+            if format is None:
+                raise ResolveError('No nameserver of {0} answered for ' \
+                    '{1}'.format(delegation.zone or '.', name))
+            self.cache.store_response(name, type, 1, format, 
+                delegation.zone)
+            if len(format.answers) > 0 or format.header.rcode == 3:
+                answers = in_bailiwick(format.answers, delegation.zone)
+                target = chain_target(answers, name, type)
+                if target is None:
+                    return answers
+                return extend_answers(answers, self.lookup(target, type, 
+                    depth + 1))
+            delegation = self.follow_referral(format, name, delegation)
+            if delegation is None:
+                return format.answers
+
+    def ask_delegation(self, delegation, name, type, depth):
+        '''query zone nameservers in turn, returns first usable responce
+        '''
+        servers = delegation.servers()
+        random.shuffle(servers)
+        format = self.query_servers(servers, name, type)
+        if format is not None and format.header.rcode in (0, 3):
+            return format
+        for ns_name in delegation.glueless_names():
+            if is_subdomain(ns_name, delegation.zone):
+                continue
+            try:
+                answers = self.lookup(ns_name, 1, depth + 1)
+            except ResolveError:
+                continue
+            addresses = [rr.resource_data.ip for rr in answers
+                if rr.type == 1]
+            if len(addresses) == 0:
+                continue
+            delegation.addresses[ns_name] = addresses
+            format = self.query_servers(addresses, name, type)
+            if format is not None and format.header.rcode in (0, 3):
+                return format
+        return None
+
+    def follow_referral(self, format, name, delegation):
+        '''caches referral to child zone, returns its delegation or None
+        '''
+        ns_records = [rr for rr in format.authority_RRs if rr.type == 2]
+        if len(ns_records) == 0:
+            return None
+        zone = normalize_name(ns_records[0].name)
+        if zone == delegation.zone or not is_subdomain(zone,
+                delegation.zone) or not is_subdomain(name, zone):
+            return None
+        names = []
+        ttl = ns_records[0].ttl
+        for rr in ns_records:
+            if normalize_name(rr.name) == zone:
+                names.append(normalize_name(rr.resource_data.name))
+                ttl = min(ttl, rr.ttl)
+        addresses = {}
+        for rr in format.additional_RRs:
+            glue_name = normalize_name(rr.name)
+            if rr.type == 1 and glue_name in names:
+                addresses.setdefault(glue_name, []).append(
+                    rr.resource_data.ip)
+        return self.delegations.put(zone, names, addresses, ttl)
+
+    def query_servers(self, servers, name, type):
+        '''sends non-recursive query to best servers, returns responce
+        or None, retries without EDNS on FORMERR
+        '''
+        server, format, message, messageID = self.query_udp(servers, name,
+            type, self.payload_size)
+        if format is not None and format.header.rcode == 1 and \
+                self.payload_size is not None:
+            server, format, message, messageID = self.query_udp(servers,
+                name, type, None)
+        if format is not None and format.header.tc:
+            format = self.exchange_tcp(server, message, messageID, format)
+        if format is not None and self.debug_mode:
+            print('#################  RESPONCE from {0} ' \
+                ' ##################'.format(server))
+            format.print()
+        return format
+
+    def query_udp(self, servers, name, type, payload_size):
+        '''returns (server, responce, query, ID) from best servers
+        '''
+        messageID = random.getrandbits(16)
+        message = self.encoder.encode(name, type, False, messageID,
+            payload_size)
+        def send(group, timeout):
+            if self.queries_left <= 0:
+                raise ResolveError('Query budget exceeded for {0}'.format(
+                    name))
+            self.queries_left -= len(group)
+            return self.exchange(group, message, messageID, timeout)
+        server, format = self.selector.query(servers, send, self.fanout)
+        return (server, format, message, messageID)
+
+    def exchange(self, servers, message, messageID, timeout):
+        '''udp request to servers, returns (server, responce)
+        '''
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return exchange(self.socket, servers, message, messageID, timeout,
+            self.port, max(self.payload_size or 0, 1024))
+
+    def exchange_tcp(self, server, message, messageID, truncated):
+        '''repeats truncated query over tcp, keeps truncated responce if
+        tcp fails
+        '''
+        if self.queries_left <= 0:
+            return truncated
+        self.queries_left -= 1
+        try:
+            return self.tcp_pool.query(server, message, messageID)
+        except OSError:
+            return truncated
+
+    def close(self):
+        '''close sockets
+        '''
+        self.tcp_pool.close()
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
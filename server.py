@@ -0,0 +1,350 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+stand-in authoritative DNS server for offline testing
+'''
+import argparse
+import asyncio
+import random
+import socket
+from query import DNSMessageFormat, type_codes, encode_name, encode_rr, \
+    encode_opt, header_struct, question_struct, short_struct, soa_struct, \
+    srv_struct
+from cache import normalize_name, is_subdomain
+
+
+def encode_rdata(type, fields):
+    '''wire format rdata from zone file fields
+    '''
+    if type == 1:
+        return socket.inet_aton(fields[0])
+    elif type == 28:
+        return socket.inet_pton(socket.AF_INET6, fields[0])
+    elif type == 2 or type == 5:
+        return encode_name(fields[0])
+    elif type == 15:
+        return short_struct.pack(int(fields[0])) + encode_name(fields[1])
+    elif type == 16:
+        data = b''
+        for string in ' '.join(fields).split('"')[1::2]:
+            string = bytes(string, 'utf-8')
+            data += bytes([len(string)]) + string
+        return data
+    elif type == 33:
+        return srv_struct.pack(*[int(field) for field in fields[0:3]]) + \
+            encode_name(fields[3])
+    elif type == 6:
+        return encode_name(fields[0]) + encode_name(fields[1]) + \
+            soa_struct.pack(*[int(field) for field in fields[2:7]])
+    raise ValueError('Unsupported record type {0}'.format(type))
+
+def decode_rdata_name(rdata):
+    '''name from uncompressed rdata
+    '''
+    labels = []
+    index = 0
+    while rdata[index] != 0:
+        labels.append(str(rdata[index + 1:index + 1 + rdata[index]],
+            'utf-8'))
+        index += rdata[index] + 1
+    return '.'.join(labels)
+
+def build_responce(query, rcode, aa, answers, authority, additional,
+        tc=0):
+    '''responce message to decoded query
+    '''
+    question = query.questions[0]
+    meta = (1<<15) | (aa<<10) | (tc<<9) | (query.header.rd<<8) | rcode
+    ar_count = len(additional)
+    if query.opt is not None:
+        ar_count += 1
+    message = bytearray(header_struct.pack(query.header.messageID, meta, 1,
+        len(answers), len(authority), ar_count))
+    message += encode_name(question.name)
+    message += question_struct.pack(question.type, question.request_class)
+    for name, type, ttl, rdata in answers + authority + additional:
+        message += encode_rr(name, type, 1, ttl, rdata)
+    if query.opt is not None:
+        message += encode_opt(1232)
+    return bytes(message)
+
+
+class Zones:
+    '''authoritative records loaded from zone file
+    '''
+
+
+    def __init__(self):
+        self.records = {}
+        self.names = set()
+
+    def add(self, name, ttl, type, rdata):
+        '''add record
+        '''
+        name = normalize_name(name)
+        self.records.setdefault((name, type), []).append((ttl, rdata))
+        self.names.add(name)
+
+    def load(self, lines):
+        '''reads "name ttl [IN] type data" lines, ; starts comment
+        '''
+        for line in lines:
+            fields = line.split(';')[0].split()
+            if len(fields) < 4:
+                continue
+            if fields[2].upper() == 'IN':
+                del fields[2]
+            type = type_codes[fields[2].upper()]
+            self.add(fields[0], int(fields[1]), type,
+                encode_rdata(type, fields[3:]))
+
+    def records_of(self, name, type):
+        '''list of (name, type, ttl, rdata)
+        '''
+        return [(name, type, ttl, rdata) for ttl, rdata
+            in self.records.get((name, type), [])]
+
+    def find_apex(self, name):
+        '''closest enclosing zone with SOA or None
+        '''
+        while True:
+            if (name, 6) in self.records:
+                return name
+            if name == '':
+                return None
+            dot = name.find('.')
+            if dot < 0:
+                name = ''
+            else:
+                name = name[dot + 1:]
+
+    def find_cut(self, name, apex):
+        '''closest delegation point between name and apex or None
+        '''
+        cut = None
+        while name != apex:
+            if (name, 2) in self.records:
+                cut = name
+            dot = name.find('.')
+            if dot < 0:
+                break
+            name = name[dot + 1:]
+        return cut
+
+    def glue(self, ns_records):
+        '''addresses of nameservers
+        '''
+        result = []
+        for record in ns_records:
+            ns_name = decode_rdata_name(record[3])
+            result.extend(self.records_of(ns_name, 1))
+            result.extend(self.records_of(ns_name, 28))
+        return result
+
+    def lookup(self, name, type):
+        '''returns (rcode, aa, answers, authority, additional)
+        '''
+        name = normalize_name(name)
+        apex = self.find_apex(name)
+        if apex is None:
+            return (5, 0, [], [], [])
+        cut = self.find_cut(name, apex)
+        if cut is not None:
+            authority = self.records_of(cut, 2)
+            return (0, 0, [], authority, self.glue(authority))
+        answers = []
+        current = name
+        for i in range(8):
+            records = self.records_of(current, type)
+            if len(records) > 0:
+                answers.extend(records)
+                break
+            cname = self.records_of(current, 5)
+            if type == 5 or len(cname) == 0:
+                break
+            answers.extend(cname)
+            current = decode_rdata_name(cname[0][3])
+            if not is_subdomain(current, apex):
+                break
+        if len(answers) > 0:
+            return (0, 1, answers, [], [])
+        soa = self.records_of(apex, 6)
+        if name in self.names:
+            return (0, 1, [], soa, [])
+        return (3, 1, [], soa, [])
+
+
+class StandInServer:
+    '''serves zones over udp and tcp, injects latency, loss and truncation
+    '''
+
+
+    def __init__(self, zones, latency=0, jitter=0, loss=0, truncate=0,
+            seed=None):
+        self.zones = zones
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.truncate = truncate
+        self.random = random.Random(seed)
+        self.udp_transport = None
+        self.tcp_server = None
+        self.queries = 0
+        self.dropped = 0
+        self.truncated = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def delay(self):
+        '''injected latency for one responce
+        '''
+        return self.latency + self.random.uniform(0, self.jitter)
+
+    def begin(self):
+        '''responce is waiting for its injected delay
+        '''
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self):
+        '''responce was sent or dropped
+        '''
+        self.in_flight -= 1
+
+    def answer(self, data, udp):
+        '''responce bytes for query, None for undecodable queries
+        '''
+        query = DNSMessageFormat()
+        try:
+            query.decode(data)
+        except Exception:
+            return None
+        if len(query.questions) != 1:
+            return None
+        self.queries += 1
+        question = query.questions[0]
+        rcode, aa, answers, authority, additional = self.zones.lookup(
+            question.name, question.type)
+        responce = build_responce(query, rcode, aa, answers, authority,
+            additional)
+        if not udp:
+            return responce
+        limit = 512
+        if query.opt is not None:
+            limit = max(query.opt.request_class, 512)
+        if len(responce) > limit or self.random.random() < self.truncate:
+            self.truncated += 1
+            responce = build_responce(query, rcode, aa, [], [], [], tc=1)
+        return responce
+
+    async def start(self, host='127.0.0.1', port=5353):
+        '''listen on udp and tcp, returns bound port
+        '''
+        loop = asyncio.get_running_loop()
+        self.udp_transport, protocol = await loop.create_datagram_endpoint(
+            lambda: UDPServerProtocol(self), local_addr=(host, port))
+        port = self.udp_transport.get_extra_info('sockname')[1]
+        self.tcp_server = await asyncio.start_server(self.handle_tcp, host,
+            port)
+        return port
+
+    async def handle_tcp(self, reader, writer):
+        '''answers framed queries until client closes connection
+        '''
+        try:
+            while True:
+                length = short_struct.unpack(await reader.readexactly(2))[0]
+                responce = self.answer(await reader.readexactly(length),
+                    False)
+                if responce is not None:
+                    asyncio.ensure_future(self.reply_tcp(writer, responce))
+        except (asyncio.IncompleteReadError, OSError):
+            writer.close()
+
+    async def reply_tcp(self, writer, responce):
+        '''send framed responce after injected delay
+        '''
+        self.begin()
+        await asyncio.sleep(self.delay())
+        self.end()
+        if not writer.is_closing():
+            writer.write(short_struct.pack(len(responce)) + responce)
+
+    def close(self):
+        '''stop listening
+        '''
+        if self.udp_transport is not None:
+            self.udp_transport.close()
+            self.udp_transport = None
+        if self.tcp_server is not None:
+            self.tcp_server.close()
+            self.tcp_server = None
+
+
+class UDPServerProtocol(asyncio.DatagramProtocol):
+    '''udp side of stand-in server
+    '''
+
+
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.server.random.random() < self.server.loss:
+            self.server.dropped += 1
+            return
+        responce = self.server.answer(data, True)
+        if responce is None:
+            return
+        delay = self.server.delay()
+        self.server.begin()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.send,
+                responce, addr)
+        else:
+            self.send(responce, addr)
+
+    def send(self, responce, addr):
+        self.server.end()
+        self.transport.sendto(responce, addr)
+
+
+async def serve(server, host, port):
+    '''run until cancelled
+    '''
+    port = await server.start(host, port)
+    print('Serving on {0}:{1}'.format(host, port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Stand-in authoritative DNS server')
+    parser.add_argument('zone_file', help='Zone file to serve')
+    parser.add_argument('--host', default='127.0.0.1', help='Address')
+    parser.add_argument('--port', '-p', type=int, default=5353,
+        help='UDP and TCP port')
+    parser.add_argument('--latency', type=float, default=0,
+        help='Added delay per responce, seconds')
+    parser.add_argument('--jitter', type=float, default=0,
+        help='Random extra delay up to this many seconds')
+    parser.add_argument('--loss', type=float, default=0,
+        help='Fraction of udp queries dropped')
+    parser.add_argument('--truncate', type=float, default=0,
+        help='Fraction of udp responces sent truncated')
+    parsed = parser.parse_args()
+
+    zones = Zones()
+    with open(parsed.zone_file) as zone_file:
+        zones.load(zone_file)
+    server = StandInServer(zones, parsed.latency, parsed.jitter,
+        parsed.loss, parsed.truncate)
+    try:
+        asyncio.run(serve(server, parsed.host, parsed.port))
+    except KeyboardInterrupt:
+        pass
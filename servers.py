@@ -0,0 +1,281 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+nameserver selection by smoothed round trip time
+'''
+import threading
+import time
+from query import DNSMessageFormat
+
+
+def exchange(sock, servers, message, messageID, timeout, port=53,
+        buffer_size=1024, metrics=None):
+    '''sends message to all servers at once, returns (server, responce)
+    of first NOERROR or NXDOMAIN responce, else last error responce or
+    (None, None) on timeout; send, wait and decode stage timings go to
+    metrics when given
+    '''
+    failed = (None, None)
+    sent = []
+    for server in servers:
+        if metrics is not None:
+            start = time.perf_counter()
+        try:
+            sock.sendto(message, (server, port))
+        except OSError:
+            continue
+        if metrics is not None:
+            metrics.observe('send_seconds', server,
+                time.perf_counter() - start)
+        sent.append(server)
+    if metrics is not None:
+        start = time.perf_counter()
+    if len(sent) == 0:
+        return (None, None)
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return failed
+        sock.settimeout(remaining)
+        try:
+            responce, address = sock.recvfrom(buffer_size)
+        except OSError:
+            return failed
+        if address[0] not in sent:
+            continue
+        if metrics is not None:
+            received = time.perf_counter()
+            metrics.observe('wait_seconds', address[0], received - start)
+        format = DNSMessageFormat()
+        try:
+            format.decode(responce)
+        except Exception:
+            continue
+        if metrics is not None:
+            metrics.observe('decode_seconds', address[0],
+                time.perf_counter() - received)
+        if format.header.messageID != messageID:
+            continue
+        if format.header.rcode == 0 or format.header.rcode == 3:
+            return (address[0], format)
+        failed = (address[0], format)
+        sent.remove(address[0])
+        if len(sent) == 0:
+            return failed
+
+def exchange_many(sock, server, queries, timeout, port=53,
+        buffer_size=1024):
+    '''sends all queries (dict ID -> message) to server at once, returns
+    dict ID -> responce of those answered before timeout
+    '''
+    result = {}
+    try:
+        for message in queries.values():
+            sock.sendto(message, (server, port))
+    except OSError:
+        return result
+    deadline = time.monotonic() + timeout
+    while len(result) < len(queries):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        sock.settimeout(remaining)
+        try:
+            responce, address = sock.recvfrom(buffer_size)
+        except OSError:
+            break
+        if address[0] != server:
+            continue
+        format = DNSMessageFormat()
+        try:
+            format.decode(responce)
+        except Exception:
+            continue
+        if format.header.messageID in queries:
+            result[format.header.messageID] = format
+    return result
+
+
+class ServerStats:
+    '''round trip statistics of one server
+    '''
+
+
+    def __init__(self, initial_rtt):
+        self.srtt = initial_rtt
+        self.rttvar = initial_rtt / 2
+        self.samples = 0
+        self.failures = 0
+        self.retry_at = 0
+
+
+class ServerSelector:
+    '''prefers servers with lowest smoothed rtt, backs off failing ones,
+    safe to share between threads
+    '''
+
+
+    def __init__(self, initial_rtt=0.5, min_timeout=0.2, max_timeout=5,
+            backoff=1, max_backoff=60, clock=time.monotonic):
+        self.initial_rtt = initial_rtt
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.servers = {}
+        self.lock = threading.RLock()
+
+    def stats(self, server):
+        '''statistics for server
+        '''
+        with self.lock:
+            stats = self.servers.get(server)
+            if stats is None:
+                stats = ServerStats(self.initial_rtt)
+                self.servers[server] = stats
+            return stats
+
+    def rank(self, servers):
+        '''healthy servers by srtt, then backed off ones by retry time
+        '''
+        now = self.clock()
+        healthy = []
+        failing = []
+        with self.lock:
+            for server in servers:
+                if self.stats(server).retry_at > now:
+                    failing.append(server)
+                else:
+                    healthy.append(server)
+            healthy.sort(key=lambda server: self.servers[server].srtt)
+            failing.sort(key=lambda server: self.servers[server].retry_at)
+        return healthy + failing
+
+    def timeout(self, server):
+        '''retransmission timeout, srtt + 4 * rttvar once measured
+        '''
+        with self.lock:
+            stats = self.stats(server)
+            if stats.samples == 0:
+                return self.max_timeout
+            return min(self.max_timeout, max(self.min_timeout,
+                stats.srtt + 4 * stats.rttvar))
+
+    def record_success(self, server, rtt, sample=True):
+        '''clear backoff, update srtt unless rtt is not a valid sample
+        (responce to retransmitted query)
+        '''
+        with self.lock:
+            stats = self.stats(server)
+            stats.failures = 0
+            stats.retry_at = 0
+            if not sample:
+                return
+            if stats.samples == 0:
+                stats.srtt = rtt
+                stats.rttvar = rtt / 2
+            else:
+                stats.rttvar = 0.75 * stats.rttvar + \
+                    0.25 * abs(stats.srtt - rtt)
+                stats.srtt = 0.875 * stats.srtt + 0.125 * rtt
+            stats.samples += 1
+
+    def record_failure(self, server):
+        '''exponential backoff for failed server
+        '''
+        with self.lock:
+            stats = self.stats(server)
+            stats.failures += 1
+            stats.retry_at = self.clock() + min(self.max_backoff,
+                self.backoff * 2 ** (stats.failures - 1))
+
+    def query(self, servers, send, fanout=1):
+        '''tries ranked servers, fanout at a time; send(group, timeout)
+        returns (server, responce) like exchange
+        '''
+        ranked = self.rank(servers)
+        fanout = max(fanout, 1)
+        result = (None, None)
+        for i in range(0, len(ranked), fanout):
+            group = ranked[i:i + fanout]
+            timeout = max(self.timeout(server) for server in group)
+            start = time.monotonic()
+            server, format = send(group, timeout)
+            if format is not None and format.header.rcode in (0, 3):
+                self.record_success(server, time.monotonic() - start)
+                return (server, format)
+            if format is not None:
+                result = (server, format)
+            for server in group:
+                self.record_failure(server)
+        return result
+
+
+class RetryScheduler:
+    '''per-query time budget, retransmits with exponential backoff
+    '''
+
+
+    def __init__(self, budget=5, attempts=4, initial_timeout=0.5, 
+            backoff=2, clock=time.monotonic):
+        self.budget = budget
+        self.attempts = attempts
+        self.initial_timeout = initial_timeout
+        self.backoff = backoff
+        self.clock = clock
+
+    def timeouts(self, first_timeout=None):
+        '''yields wait time of each transmission until attempts or budget
+        run out
+        '''
+        if first_timeout is None:
+            first_timeout = self.initial_timeout
+        deadline = self.clock() + self.budget
+        timeout = first_timeout
+        for i in range(self.attempts):
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                return
+            yield min(timeout, remaining)
+            timeout *= self.backoff
+
+    def first_timeout(self, selector, servers):
+        '''measured retransmission timeout of servers, initial timeout
+        for servers without samples
+        '''
+        timeout = 0
+        for server in servers:
+            if selector.stats(server).samples == 0:
+                timeout = max(timeout, self.initial_timeout)
+            else:
+                timeout = max(timeout, selector.timeout(server))
+        return timeout
+
+    def query(self, selector, servers, send, fanout=1):
+        '''like ServerSelector.query, but each retransmission goes to the
+        next ranked servers and waits longer; returns (server, responce)
+        or (None, None) when budget is spent
+        '''
+        ranked = selector.rank(servers)
+        if len(ranked) == 0:
+            return (None, None)
+        fanout = min(max(fanout, 1), len(ranked))
+        result = (None, None)
+        first = ranked[0:fanout]
+        for attempt, timeout in enumerate(self.timeouts(
+                self.first_timeout(selector, first))):
+            index = attempt * fanout
+            group = [ranked[(index + i) % len(ranked)] 
+                for i in range(fanout)]
+            start = time.monotonic()
+            server, format = send(group, timeout)
+            if format is not None and format.header.rcode in (0, 3):
+                selector.record_success(server, time.monotonic() - start, 
+                    attempt == 0)
+                return (server, format)
+            if format is not None:
+                result = (server, format)
+            for server in group:
+                selector.record_failure(server)
+        return result
@@ -0,0 +1,279 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+thread-safe resolver sharing sockets and cache between threads
+'''
+import concurrent.futures
+import itertools
+import random
+import socket
+import threading
+from query import DNSMessageFormat, QueryEncoder
+from cache import DNSCache, make_key, chain_target, extend_answers
+from servers import ServerSelector, RetryScheduler
+from tcp import TCPConnectionPool
+
+
+class PendingQuery:
+    '''query waiting for its responce
+    '''
+
+    __slots__ = ('key', 'servers', 'event', 'server', 'responce', 'error')
+
+    def __init__(self, key):
+        self.key = key
+        self.servers = set()
+        self.event = threading.Event()
+        self.server = None
+        self.responce = None
+        self.error = None
+
+
+class SharedSocket:
+    '''udp socket with receiver thread, responces are handed to waiting
+    threads by message ID
+    '''
+
+
+    def __init__(self, port=53, buffer_size=4096, poll_interval=0.2):
+        self.port = port
+        self.buffer_size = buffer_size
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('0.0.0.0', 0))
+        self.socket.settimeout(poll_interval)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.closed = False
+        self.thread = threading.Thread(target=self.receive, daemon=True)
+        self.thread.start()
+
+    def register(self, key):
+        '''reserve free message ID, returns (ID, PendingQuery)
+        '''
+        query = PendingQuery(key)
+        with self.lock:
+            messageID = random.getrandbits(16)
+            while messageID in self.pending:
+                messageID = random.getrandbits(16)
+            self.pending[messageID] = query
+        return messageID, query
+
+    def unregister(self, messageID):
+        '''forget query
+        '''
+        with self.lock:
+            self.pending.pop(messageID, None)
+
+    def send(self, message, server):
+        '''send query datagram
+        '''
+        self.socket.sendto(message, (server, self.port))
+
+    def receive(self):
+        '''receiver thread, matches responces by ID, server and question
+        '''
+        while not self.closed:
+            try:
+                data, address = self.socket.recvfrom(self.buffer_size)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            format = DNSMessageFormat()
+            try:
+                format.decode(data)
+            except Exception:
+                continue
+            with self.lock:
+                query = self.pending.get(format.header.messageID)
+            if query is None or address[0] not in query.servers or \
+                    len(format.questions) == 0:
+                continue
+            question = format.questions[0]
+            if make_key(question.name, question.type, 
+                    question.request_class) != query.key:
+                continue
+            query.server = address[0]
+            query.responce = format
+            query.event.set()
+
+    def close(self):
+        '''stop receiver thread and close socket
+        '''
+        self.closed = True
+        self.thread.join()
+        self.socket.close()
+
+
+class SharedResolver:
+    '''resolver for many threads at once, queries are spread over a small
+    pool of sockets, cache and server statistics are shared
+    '''
+
+
+    def __init__(self, server='8.8.8.8', sockets=4, port=53, cache=None, 
+            selector=None, scheduler=None, payload_size=1232, max_chain=8, 
+            serve_stale=True, prefetch=True, refresh_workers=4):
+        if cache is None:
+            cache = DNSCache()
+        if selector is None:
+            selector = ServerSelector()
+        if scheduler is None:
+            scheduler = RetryScheduler()
+        if isinstance(server, str):
+            server = [server]
+        self.servers = [socket.gethostbyname(address) for address in server]
+        self.cache = cache
+        self.selector = selector
+        self.scheduler = scheduler
+        self.payload_size = payload_size
+        self.max_chain = max_chain
+        self.serve_stale = serve_stale
+        self.prefetch = prefetch
+        self.encoder = QueryEncoder()
+        self.tcp_pool = TCPConnectionPool(port=port)
+        self.cache_lock = threading.Lock()
+        self.encoder_lock = threading.Lock()
+        self.tcp_lock = threading.Lock()
+        self.tcp_locks = {}
+        self.inflight_lock = threading.Lock()
+        self.inflight = {}
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresher = concurrent.futures.ThreadPoolExecutor(
+            max(refresh_workers, 1))
+        self.sockets = [SharedSocket(port, max(payload_size or 0, 1024)) 
+            for i in range(max(sockets, 1))]
+        self.counter = itertools.count()
+
+    def query_udp(self, name, type, recursion_desired, payload_size):
+        '''query best servers over one of the shared sockets, returns
+        (server, responce, query, ID), responce is None on timeout
+        '''
+        shared = self.sockets[next(self.counter) % len(self.sockets)]
+        messageID, pending = shared.register(make_key(name, type))
+        with self.encoder_lock:
+            message = self.encoder.encode(name, type, recursion_desired, 
+                messageID, payload_size)
+        def send(group, timeout):
+            pending.event.clear()
+            pending.servers.update(group)
+            for server in group:
+                shared.send(message, server)
+            if not pending.event.wait(timeout):
+                return (None, None)
+            return (pending.server, pending.responce)
+        try:
+            server, format = self.scheduler.query(self.selector, 
+                self.servers, send)
+        finally:
+            shared.unregister(messageID)
+        return (server, format, message, messageID)
+
+    def query(self, name, type=1, recursion_desired=True):
+        '''send query, returns decoded responce, raises TimeoutError,
+        threads asking the same question at once share one upstream query
+        '''
+        key = (make_key(name, type), recursion_desired)
+        with self.inflight_lock:
+            flight = self.inflight.get(key)
+            if flight is None:
+                flight = self.inflight[key] = PendingQuery(key)
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.responce
+        try:
+            flight.responce = self.query_upstream(name, type, 
+                recursion_desired)
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.inflight_lock:
+                del self.inflight[key]
+            flight.event.set()
+        return flight.responce
+
+    def query_upstream(self, name, type=1, recursion_desired=True):
+        '''send query, returns decoded responce, raises TimeoutError
+        '''
+        server, format, message, messageID = self.query_udp(name, type, 
+            recursion_desired, self.payload_size)
+        if format is not None and format.header.rcode == 1 and \
+                self.payload_size is not None:
+            server, format, message, messageID = self.query_udp(name, 
+                type, recursion_desired, None)
+        if format is None:
+            raise TimeoutError('Time Out: {0}'.format(name))
+        if format.header.tc:
+            with self.tcp_lock:
+                connection = self.tcp_pool.connection(server)
+                lock = self.tcp_locks.setdefault(server, threading.Lock())
+            with lock:
+                try:
+                    format = connection.query(message, messageID)
+                except OSError:
+                    pass
+        return format
+
+    def resolve(self, name, type=1, recursion_desired=True):
+        '''resolve name chasing CNAME chain, returns answer records
+        '''
+        with self.cache_lock:
+            answers, target = self.cache.get_chain(name, type, 
+                max_length=self.max_chain, stale=self.serve_stale, 
+                prefetch=self.prefetch)
+        self.refresh_due(recursion_desired)
+        chain = set()
+        while target is not None:
+            chain.add(target)
+            format = self.query(target, type, recursion_desired)
+            with self.cache_lock:
+                self.cache.store_response(target, type, 1, format)
+            answers = extend_answers(answers, format.answers)
+            target = chain_target(format.answers, target, type)
+            if target is not None and target not in chain:
+                with self.cache_lock:
+                    cached, target = self.cache.get_chain(target, type, 
+                        max_length=self.max_chain, 
+                        stale=self.serve_stale, prefetch=self.prefetch)
+                self.refresh_due(recursion_desired)
+                answers = extend_answers(answers, cached)
+            if target in chain or len(chain) >= self.max_chain:
+                break
+        return answers
+
+    def refresh_due(self, recursion_desired=True):
+        '''queues background refresh of cache entries due for it on the
+        refresh workers
+        '''
+        with self.cache_lock:
+            due = self.cache.take_due()
+        for name, type, request_class in due:
+            self.refresher.submit(self.refresh, name, type, 
+                recursion_desired)
+
+    def refresh(self, name, type, recursion_desired=True):
+        '''re-query cached name, stale entry stays when upstream fails
+        '''
+        try:
+            format = self.query(name, type, recursion_desired)
+        except Exception:
+            return
+        with self.cache_lock:
+            self.cache.store_response(name, type, 1, format)
+            self.refreshes += 1
+
+    def close(self):
+        '''close sockets, drops queued refreshes
+        '''
+        self.refresher.shutdown(wait=False, cancel_futures=True)
+        for shared in self.sockets:
+            shared.close()
+        with self.tcp_lock:
+            self.tcp_pool.close()
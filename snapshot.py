@@ -0,0 +1,87 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+cache snapshot file for warm start
+'''
+import os
+import struct
+import time
+from query import LazySection, ResourceRecord
+
+
+magic = b'DNSC\x00\x01'
+count_struct = struct.Struct('>I')
+entry_struct = struct.Struct('>dHHBHHI')
+offsets_structs = {}
+
+
+def offsets_struct(count):
+    '''struct of count record offsets
+    '''
+    result = offsets_structs.get(count)
+    if result is None:
+        result = offsets_structs[count] = struct.Struct('>{0}I'.format(count))
+    return result
+
+
+def save_snapshot(cache, path, wall_clock=time.time):
+    '''writes live cache entries with absolute expiry, oldest first,
+    returns number of entries written
+    '''
+    now = cache.clock()
+    offset = wall_clock() - now
+    chunks = []
+    for (name, type, request_class), entry in cache.entries.items():
+        if entry.expires <= now:
+            continue
+        name = bytes(name, 'utf-8')
+        records = [record.encode() for record in entry.records]
+        starts = []
+        length = 0
+        for record in records:
+            starts.append(length)
+            length += len(record)
+        chunks.append(entry_struct.pack(entry.expires + offset, type, 
+            request_class, entry.rcode, len(records), len(name), length) + 
+            name + offsets_struct(len(records)).pack(*starts) + 
+            b''.join(records))
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as snapshot:
+        snapshot.write(magic + count_struct.pack(len(chunks)))
+        snapshot.write(b''.join(chunks))
+    os.replace(temporary, path)
+    return len(chunks)
+
+def load_snapshot(cache, path, wall_clock=time.time):
+    '''puts unexpired snapshot entries into cache, records are decoded
+    on first access, returns number of entries loaded
+    '''
+    try:
+        with open(path, 'rb') as snapshot:
+            data = memoryview(snapshot.read())
+    except FileNotFoundError:
+        return 0
+    if bytes(data[0:len(magic)]) != magic:
+        raise ValueError('Not a cache snapshot: {0}'.format(path))
+    offset = len(magic)
+    count = count_struct.unpack_from(data, offset)[0]
+    offset += count_struct.size
+    now = wall_clock()
+    loaded = 0
+    for i in range(count):
+        expires, type, request_class, rcode, records, name_length, \
+            length = entry_struct.unpack_from(data, offset)
+        offset += entry_struct.size
+        ttl = expires - now
+        if ttl > 0:
+            name = str(data[offset:offset + name_length], 'utf-8')
+            offset += name_length
+            starts = offsets_struct(records).unpack_from(data, offset)
+            offset += 4 * records
+            cache.put(name, type, request_class, LazySection(data, {}, 
+                [offset + start for start in starts], ResourceRecord), 
+                rcode, ttl)
+            loaded += 1
+        else:
+            offset += name_length + 4 * records
+        offset += length
+    return loaded
@@ -0,0 +1,151 @@
+'''
+Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
+DNS over TCP with pipelining (RFC 7766)
+'''
+import socket
+from query import DNSMessageFormat, short_struct
+
+
+def read_exact(sock, length):
+    '''reads exactly length bytes
+    '''
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        data += chunk
+    return bytes(data)
+
+def frame(message):
+    '''prepends 2-byte length
+    '''
+    return short_struct.pack(len(message)) + message
+
+
+class TCPConnection:
+    '''persistent connection, queries in flight matched by message ID
+    '''
+
+
+    def __init__(self, server, port=53, timeout=5, ssl_context=None):
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.socket = None
+        self.responces = {}
+
+    def connect(self):
+        '''open connection, TLS when ssl context is given
+        '''
+        sock = socket.create_connection((self.server, self.port),
+            self.timeout)
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock,
+                server_hostname=self.server)
+        sock.settimeout(self.timeout)
+        self.socket = sock
+        self.responces = {}
+
+    def send(self, message):
+        '''send framed query
+        '''
+        if self.socket is None:
+            self.connect()
+        self.socket.sendall(frame(message))
+
+    def receive(self, messageID):
+        '''read responces until one with messageID, others are kept,
+        undecodable ones are skipped, raises OSError when it is ours
+        '''
+        if messageID in self.responces:
+            return self.responces.pop(messageID)
+        while True:
+            length = short_struct.unpack(read_exact(self.socket, 2))[0]
+            data = read_exact(self.socket, length)
+            format = DNSMessageFormat()
+            try:
+                format.decode(data)
+            except Exception:
+                if data[0:2] == short_struct.pack(messageID):
+                    raise OSError('Malformed responce from {0}'.format(
+                        self.server))
+                continue
+            if format.header.messageID == messageID:
+                return format
+            self.responces[format.header.messageID] = format
+
+    def query(self, message, messageID):
+        '''send query and wait for its responce, reconnects once if
+        server closed idle connection
+        '''
+        try:
+            self.send(message)
+            return self.receive(messageID)
+        except ConnectionError:
+            self.close()
+        except OSError:
+            self.close()
+            raise
+        self.send(message)
+        return self.receive(messageID)
+
+    def query_many(self, queries):
+        '''pipelines list of (messageID, message), returns responces in
+        the same order
+        '''
+        try:
+            for messageID, message in queries:
+                self.send(message)
+            return [self.receive(messageID) for messageID, message
+                in queries]
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        '''close connection
+        '''
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+class TCPConnectionPool:
+    '''long-lived connections, one per server
+    '''
+
+
+    def __init__(self, port=53, timeout=5, ssl_context=None):
+        self.port = port
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.connections = {}
+
+    def connection(self, server):
+        '''connection to server
+        '''
+        connection = self.connections.get(server)
+        if connection is None:
+            connection = TCPConnection(server, self.port, self.timeout,
+                self.ssl_context)
+            self.connections[server] = connection
+        return connection
+
+    def query(self, server, message, messageID):
+        '''query over pooled connection
+        '''
+        return self.connection(server).query(message, messageID)
+
+    def query_many(self, server, queries):
+        '''pipelined queries over pooled connection
+        '''
+        return self.connection(server).query_many(queries)
+
+    def close(self):
+        '''close all connections
+        '''
+        for connection in self.connections.values():
+            connection.close()
+        self.connections.clear()
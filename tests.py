@@ -3,9 +3,48 @@ Copyright (c) 2014 Valera Likhosherstov <v.lihosherstov@gmail.com>
 tests
 '''
 import unittest
+import asyncio
+import contextlib
+import io
+import json
+import socket
+import struct
+import tempfile
+import threading
+import time
+import types
 from query import MessageHeader, DNSQuestion, ResourceRecord, \
-    AResourceData, AAAAResourceData, CNAMEResourceData, \
-    DNSMessageFormat
+    AResourceData, AAAAResourceData, DNSMessageFormat, QueryEncoder, \
+    decode_string, skip_name, encode_opt, LazyMessage, answer_addresses
+from cache import DNSCache, chain_target
+from async_client import AsyncDNSClient
+from batch import BatchResolver, read_names
+from resolver import IterativeResolver, ResolveError
+from servers import ServerSelector, RetryScheduler
+from tcp import TCPConnection, read_exact, frame
+from benchmark import read_corpus, regressions
+from server import Zones, StandInServer
+from loadgen import LoadGenerator
+from metrics import Metrics
+from client import DNSClient
+from pool import ResolverPool, shard
+from shared import SharedResolver
+from snapshot import save_snapshot, load_snapshot
+from capture import DumpReader, write_framed
+from columns import ResponseTable
+from interface import parse_arguments
+
+
+message1 = b'\x41\x21\x81\x80\x00\x01\x00\x02\x00' + \
+    b'\x00\x00\x00\x04\x74\x61\x67\x73\x07\x62\x6c\x75' + \
+    b'\x65\x6b\x61\x69\x03\x63\x6f\x6d\x00\x00\x01\x00' + \
+    b'\x01\xc0\x0c\x00\x05\x00\x01\x00\x00\x00\x96\x00' + \
+    b'\x0b\x04\x74\x61\x67\x73\x03\x77\x64\x63\xc0\x11' + \
+    b'\xc0\x2e\x00\x01\x00\x01\x00\x00\x0a\x27\x00\x04' + \
+    b'\xad\xc0\xdc\x40'
+nxdomain = bytes.fromhex('123481830001000000010000016103636f6d' + 
+    '0000010001c00e000600010000012c0020026e73c00e04686f7374c00e0000' + 
+    '000100001c2000000384001275000000003c')
 
 
 class DNSqueryTestCase(unittest.TestCase):
@@ -16,13 +55,7 @@ class DNSqueryTestCase(unittest.TestCase):
     def setUp(self):
         '''set up
         '''
-        self.message1 = b'\x41\x21\x81\x80\x00\x01\x00\x02\x00' + \
-            b'\x00\x00\x00\x04\x74\x61\x67\x73\x07\x62\x6c\x75' + \
-            b'\x65\x6b\x61\x69\x03\x63\x6f\x6d\x00\x00\x01\x00' + \
-            b'\x01\xc0\x0c\x00\x05\x00\x01\x00\x00\x00\x96\x00' + \
-            b'\x0b\x04\x74\x61\x67\x73\x03\x77\x64\x63\xc0\x11' + \
-            b'\xc0\x2e\x00\x01\x00\x01\x00\x00\x0a\x27\x00\x04' + \
-            b'\xad\xc0\xdc\x40'
+        self.message1 = message1
 
     def test_header_decoding(self):
         '''test header
@@ -143,6 +176,118 @@ class DNSqueryTestCase(unittest.TestCase):
         self.assertEqual('173.192.220.64', 
             format.answers[1].resource_data.ip)    
 
+    def test_records_have_no_dict(self):
+        '''test slots
+        '''
+        format = DNSMessageFormat()
+        format.decode(self.message1)
+        for item in [format.header, format.questions[0], 
+                format.answers[0], format.answers[0].resource_data, 
+                format.answers[1].resource_data]:
+            self.assertFalse(hasattr(item, '__dict__'))
+
+    def test_query_encoder(self):
+        '''test template
+        '''
+        format1 = DNSMessageFormat()
+        message = format1.encode('vk.com.', True, True)
+        encoder = QueryEncoder()
+        self.assertEqual(message, encoder.encode('vk.com.', 28, True, 
+            format1.header.messageID))
+        message = encoder.encode('vk.com.', 28, True, 4660)
+        format2 = DNSMessageFormat()
+        format2.decode(message)
+        self.assertEqual(4660, format2.header.messageID)
+        self.assertEqual('vk.com', format2.questions[0].name)
+        self.assertEqual(1, len(encoder.templates))
+
+    def test_edns_opt_encoding_and_decoding(self):
+        '''test edns
+        '''
+        format1 = DNSMessageFormat()
+        message = format1.encode('vk.com', True, False, payload_size=1232)
+        self.assertEqual(message[2:], QueryEncoder().encode('vk.com', 1, 
+            True, format1.header.messageID, 1232)[2:])
+        message = message[:-2] + b'\x00\x08\x00\x0a\x00\x04abcd'
+        format2 = DNSMessageFormat()
+        format2.decode(message)
+        self.assertEqual(1, format2.header.ar_count)
+        self.assertEqual(41, format2.opt.type)
+        self.assertEqual(1232, format2.opt.request_class)
+        self.assertEqual([(10, b'abcd')], format2.opt.resource_data.options)
+        self.assertEqual(1<<15, 
+            struct.unpack('>I', encode_opt(4096, True)[5:9])[0])
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            format2.print()
+        self.assertIn('UDP payload size: 1232', output.getvalue())
+
+    def test_decode_string_pointer_cache(self):
+        '''test string
+        '''
+        names = {}
+        view = memoryview(self.message1)
+        self.assertEqual((30, 'tags.bluekai.com'), 
+            decode_string(view, 12, names))
+        self.assertEqual('bluekai.com', names[17])
+        self.assertEqual((59, 'tags.wdc.bluekai.com'), 
+            decode_string(view, 57, names))
+        self.assertRaises(ValueError, decode_string, 
+            b'\x01a\xc0\x00', 0)
+        for length in (64, 191):
+            name = bytes([length]) + b'a' * length + b'\x00'
+            self.assertRaises(ValueError, decode_string, name, 0)
+            self.assertRaises(ValueError, skip_name, name, 0)
+
+    def test_address_formatting(self):
+        '''test A and AAAA text and raw forms
+        '''
+        for packed, text in [
+                ('2a00145040100801000000000000200e', 
+                    '2a00:1450:4010:801::200e'),
+                ('20010db8000000000001000000000001', '2001:db8::1:0:0:1'),
+                ('20010db8000000010001000100010001', '2001:db8:0:1:1:1:1:1'),
+                ('00000000000000000000000000000001', '::1'),
+                ('00000000000000000000ffffc0000201', '::ffff:192.0.2.1')]:
+            self.assertEqual(text, 
+                AAAAResourceData(bytes.fromhex(packed)).ip)
+        data = AAAAResourceData(bytes.fromhex(packed))
+        self.assertEqual(bytes.fromhex(packed), data.data)
+        self.assertEqual(packed, data.hexdump(data.data))
+        with self.assertRaises(AttributeError):
+            data.data = b''
+        data = AResourceData(b'\xc0\x00\x02\x01')
+        self.assertEqual('192.0.2.1', data.ip)
+        self.assertEqual(0xc0000201, data.integer)
+        answers = [types.SimpleNamespace(type=1, resource_data=data), 
+            types.SimpleNamespace(type=5, resource_data=None)]
+        self.assertEqual(['192.0.2.1'], answer_addresses(answers))
+        self.assertEqual([b'\xc0\x00\x02\x01'], 
+            answer_addresses(answers, raw=True))
+
+    def test_lazy_message(self):
+        '''test lazy view
+        '''
+        for name, message in read_corpus():
+            eager = DNSMessageFormat()
+            eager.decode(message)
+            lazy = LazyMessage()
+            lazy.decode(message)
+            self.assertEqual([(rr.name, rr.type, rr.ttl) for rr in 
+                eager.additional_RRs], [(rr.name, rr.type, rr.ttl) for rr 
+                in lazy.additional_RRs])
+            self.assertEqual(eager.opt is None, lazy.opt is None)
+        corpus = dict(read_corpus())
+        lazy = LazyMessage()
+        lazy.decode(corpus['root_referral_com'])
+        self.assertEqual(0, len(lazy.answers))
+        self.assertEqual('a.gtld-servers.net', 
+            lazy.authority_RRs[0].resource_data.name)
+        self.assertEqual([None], lazy.authority_RRs.records[1:2])
+        self.assertEqual([None] * (len(lazy.additional_RRs) - 1), 
+            lazy.additional_RRs.records[:-1])
+        self.assertEqual(41, lazy.opt.type)
+        self.assertRaises(ValueError, lazy.decode, self.message1[:-1])
+
     def test_encoding_and_decoding(self):
         '''test format
         '''
@@ -176,5 +321,1426 @@ class DNSqueryTestCase(unittest.TestCase):
             format2.questions[0].request_class)
 
 
+class FakeClock:
+    '''manual clock for ttl tests
+    '''
+
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class DNSCacheTestCase(unittest.TestCase):
+    '''cache tests class
+    '''
+
+
+    def setUp(self):
+        '''set up
+        '''
+        self.clock = FakeClock()
+        self.cache = DNSCache(max_size=2, clock=self.clock)
+
+    def test_ttl_expiry(self):
+        '''test cache
+        '''
+        format = DNSMessageFormat()
+        format.decode(message1)
+        self.cache.store_response('tags.bluekai.com.', 1, 1, format)
+        entry = self.cache.get('TAGS.bluekai.com', 1)
+        self.assertEqual(2, len(entry.records))
+        self.clock.now = 150
+        self.assertIsNone(self.cache.get('tags.bluekai.com', 1))
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_truncated_not_cached(self):
+        '''test cache
+        '''
+        format = DNSMessageFormat()
+        format.decode(message1)
+        format.header.tc = 1
+        self.cache.store_response('tags.bluekai.com', 1, 1, format)
+        self.assertEqual(0, len(self.cache))
+
+    def test_negative_caching(self):
+        '''test cache
+        '''
+        format = DNSMessageFormat()
+        format.decode(nxdomain)
+        self.cache.store_response('a.com', 1, 1, format)
+        entry = self.cache.get('a.com', 1)
+        self.assertTrue(entry.is_negative())
+        self.assertEqual(3, entry.rcode)
+        self.clock.now = 60
+        self.assertIsNone(self.cache.get('a.com', 1))
+
+    def test_lru_eviction(self):
+        '''test cache
+        '''
+        self.cache.put('a.com', 1, 1, [], 0, 10)
+        self.cache.put('b.com', 1, 1, [], 0, 10)
+        self.cache.get('a.com', 1)
+        self.cache.put('c.com', 1, 1, [], 0, 10)
+        self.assertEqual(1, self.cache.evictions)
+        self.assertIsNone(self.cache.get('b.com', 1))
+        self.assertIsNotNone(self.cache.get('a.com', 1))
+
+    def test_negative_link_is_miss(self):
+        '''test cache
+        '''
+        self.cache.put('www.a.com', 5, 1, [], 0, 10)
+        self.assertEqual(([], 'www.a.com'), 
+            self.cache.get_chain('WWW.a.com', 1))
+
+    def test_prefetch_and_stale(self):
+        '''test cache
+        '''
+        cache = DNSCache(clock=self.clock, prefetch_fraction=0.1, 
+            prefetch_hits=2, stale_ttl=100)
+        cache.put('a.com', 1, 1, [], 0, 100)
+        key = ('a.com', 1, 1)
+        self.clock.now = 50
+        cache.get('a.com', 1, stale=True)
+        self.clock.now = 95
+        cache.get('a.com', 1)
+        cache.get('a.com', 1, stale=True)
+        self.assertEqual([], cache.take_due())
+        cache.get('a.com', 1, prefetch=True)
+        self.assertEqual([key], cache.take_due())
+        self.clock.now = 120
+        self.assertIsNone(cache.get('a.com', 1))
+        self.assertIsNone(cache.get('a.com', 1, prefetch=True))
+        self.assertIsNotNone(cache.get('a.com', 1, stale=True))
+        self.assertEqual([], cache.take_due())
+        self.clock.now = 125
+        cache.get('a.com', 1, stale=True)
+        self.assertEqual([key], cache.take_due())
+        self.assertEqual(2, cache.stats()['stale'])
+        self.clock.now = 200
+        self.assertIsNone(cache.get('a.com', 1, stale=True))
+        self.assertEqual(0, len(cache))
+
+
+def make_answer(query, data):
+    '''responce to query with single answer pointing to question
+    '''
+    question = DNSQuestion()
+    end = question.decode(query, 12)
+    return query[0:2] + b'\x81\x80\x00\x01\x00\x01\x00\x00\x00\x00' + \
+        query[12:end] + b'\xc0\x0c' + struct.pack('>HHIH', question.type, 
+            1, 300, len(data)) + data
+
+
+class ReversingServerProtocol(asyncio.DatagramProtocol):
+    '''answers batches of queries in reverse order
+    '''
+
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.queries = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries.append((data, addr))
+        if len(self.queries) == self.batch:
+            for index, query in enumerate(reversed(self.queries)):
+                self.transport.sendto(make_answer(query[0], 
+                    bytes([10, 0, 0, len(self.queries) - index])), query[1])
+            self.queries = []
+
+
+class AsyncDNSClientTestCase(unittest.TestCase):
+    '''async client tests class
+    '''
+
+
+    def test_multiplexed_queries(self):
+        '''test async client
+        '''
+        async def run():
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: ReversingServerProtocol(3), 
+                local_addr=('127.0.0.1', 0))
+            port = transport.get_extra_info('sockname')[1]
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2)
+            names = ['a.com', 'b.com', 'c.com']
+            results = await asyncio.gather(*[client.resolve(name) 
+                for name in names])
+            cached = await client.resolve('B.com.')
+            client.close()
+            transport.close()
+            return results, cached
+        results, cached = asyncio.run(run())
+        for index, name in enumerate(['a.com', 'b.com', 'c.com']):
+            self.assertEqual(name, results[index][0].name)
+            self.assertEqual('10.0.0.{0}'.format(index + 1), 
+                results[index][0].resource_data.ip)
+        self.assertIs(results[1], cached)
+
+    def test_coalescing(self):
+        '''test async client
+        '''
+        async def run():
+            server, port = await start_stand_in(latency=0.05)
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2, cache=DNSCache(max_size=0))
+            responces = await asyncio.gather(*[client.query(
+                'WWW.example.com.') for i in range(100)] + 
+                [client.query('www.example.com', 28)])
+            again = await client.query('www.example.com')
+            client.close()
+            server.close()
+            return server, client, responces, again
+        server, client, responces, again = asyncio.run(run())
+        self.assertEqual(3, server.queries)
+        self.assertEqual(99, client.coalesced)
+        self.assertEqual({}, client.inflight)
+        for responce in responces[1:100]:
+            self.assertIs(responces[0], responce)
+        self.assertIsNot(responces[0], again)
+        self.assertEqual(28, responces[100].answers[0].type)
+
+
+class BatchResolverTestCase(unittest.TestCase):
+    '''batch mode tests class
+    '''
+
+
+    def test_streamed_json_results(self):
+        '''test batch
+        '''
+        output = io.StringIO()
+        async def run():
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: ReversingServerProtocol(1), 
+                local_addr=('127.0.0.1', 0))
+            port = transport.get_extra_info('sockname')[1]
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2)
+            resolver = BatchResolver(client, concurrency=2, 
+                json_output=True, output=output)
+            elapsed = await resolver.run(read_names(
+                io.StringIO('a.com\n\n# comment\nb.com\nc.com\n')))
+            transport.close()
+            return resolver, elapsed
+        resolver, elapsed = asyncio.run(run())
+        results = [json.loads(line) for line in 
+            output.getvalue().splitlines()]
+        self.assertEqual(['a.com', 'b.com', 'c.com'], 
+            sorted(result['name'] for result in results))
+        self.assertEqual(['10.0.0.1'], results[0]['answers'])
+        self.assertEqual(0, resolver.errors)
+        self.assertTrue(resolver.summary(elapsed).startswith('3 names'))
+
+
+def make_rr(owner, rr_type, ttl, **data):
+    '''resource record with given resource data fields
+    '''
+    record = ResourceRecord()
+    record.name = owner
+    record.type = rr_type
+    record.request_class = 1
+    record.ttl = ttl
+    record.resource_data = types.SimpleNamespace(**data)
+    return record
+
+def make_responce(rcode=0, answers=[], authority=[], additional=[]):
+    '''decoded responce stand-in
+    '''
+    format = DNSMessageFormat()
+    format.header = types.SimpleNamespace(rcode=rcode, tc=0)
+    format.answers = answers
+    format.authority_RRs = authority
+    format.additional_RRs = additional
+    return format
+
+
+class FakeIterativeResolver(IterativeResolver):
+    '''answers from table keyed by server and name
+    '''
+
+
+    def __init__(self, table, **kwargs):
+        IterativeResolver.__init__(self, **kwargs)
+        self.table = table
+        self.asked = []
+
+    def exchange(self, servers, message, messageID, timeout):
+        question = DNSQuestion()
+        question.decode(message, 12)
+        server = servers[0]
+        self.asked.append((server, question.name))
+        if server in self.table:
+            return (server, self.table[server].get(question.name))
+        return (server, self.table['root'].get(question.name))
+
+
+class IterativeResolverTestCase(unittest.TestCase):
+    '''iterative resolver tests class
+    '''
+
+
+    def setUp(self):
+        '''set up
+        '''
+        com = make_responce(authority=[make_rr('com', 2, 172800, 
+            name='a.gtld-servers.net')], additional=[make_rr(
+            'a.gtld-servers.net', 1, 172800, ip='192.5.6.30')])
+        org = make_responce(authority=[make_rr('org', 2, 172800, 
+            name='a0.org-servers.net')], additional=[make_rr(
+            'a0.org-servers.net', 1, 172800, ip='199.19.56.1')])
+        example = make_responce(authority=[make_rr('example.com', 2, 
+            3600, name='ns1.provider.org')])
+        self.table = {
+            'root':{ 'example.com':com, 'www.example.com':com, 
+                'ns1.provider.org':org },
+            '192.5.6.30':{ 'example.com':example, 
+                'www.example.com':example },
+            '199.19.56.1':{ 'ns1.provider.org':make_responce(answers=[
+                make_rr('ns1.provider.org', 1, 3600, ip='10.0.0.53')]) },
+            '10.0.0.53':{ 'example.com':make_responce(answers=[
+                make_rr('example.com', 1, 300, ip='93.184.216.34')]), 
+                'www.example.com':make_responce(answers=[
+                make_rr('www.example.com', 1, 300, ip='93.184.216.35')]) }
+        }
+
+    def test_glueless_referral_and_delegation_cache(self):
+        '''test resolver
+        '''
+        resolver = FakeIterativeResolver(self.table)
+        answers = resolver.resolve('Example.com.')
+        self.assertEqual('93.184.216.34', answers[0].resource_data.ip)
+        self.assertEqual(5, len(resolver.asked))
+        resolver.asked = []
+        answers = resolver.resolve('www.example.com')
+        self.assertEqual('93.184.216.35', answers[0].resource_data.ip)
+        self.assertEqual([('10.0.0.53', 'www.example.com')], resolver.asked)
+
+    def test_out_of_zone_records_not_trusted(self):
+        '''test resolver bailiwick
+        '''
+        self.table['root']['alias.example.com'] = self.table['root'][
+            'example.com']
+        self.table['root']['www.bank.org'] = self.table['root'][
+            'ns1.provider.org']
+        self.table['192.5.6.30']['alias.example.com'] = self.table[
+            '192.5.6.30']['example.com']
+        self.table['10.0.0.53']['alias.example.com'] = make_responce(
+            answers=[make_rr('alias.example.com', 5, 300, 
+            name='www.bank.org'), make_rr('www.bank.org', 1, 300, 
+            ip='6.6.6.6')])
+        self.table['199.19.56.1']['www.bank.org'] = make_responce(
+            answers=[make_rr('www.bank.org', 1, 300, ip='10.1.1.1')])
+        resolver = FakeIterativeResolver(self.table)
+        answers = resolver.resolve('alias.example.com')
+        self.assertEqual([(5, 'www.bank.org'), (1, '10.1.1.1')], 
+            [(rr.type, rr.resource_data.name if rr.type == 5 else 
+            rr.resource_data.ip) for rr in answers])
+        self.assertIn(('199.19.56.1', 'www.bank.org'), resolver.asked)
+        self.assertEqual('10.1.1.1', resolver.cache.get('www.bank.org', 
+            1).records[0].resource_data.ip)
+        answers = resolver.resolve('alias.example.com')
+        self.assertEqual('10.1.1.1', answers[-1].resource_data.ip)
+
+    def test_query_budget(self):
+        '''test resolver
+        '''
+        resolver = FakeIterativeResolver(self.table, max_queries=3)
+        self.assertRaises(ResolveError, resolver.resolve, 'example.com')
+
+    def test_non_recursive_lookup(self):
+        '''test client lookup without recursion
+        '''
+        client = DNSClient(server='127.0.0.1')
+        client.resolver = FakeIterativeResolver(self.table, 
+            cache=client.cache)
+        result = client.lookup('www.example.com', ['A'], 
+            recursion_desired=False)
+        failed = client.lookup('missing.example.com', ['A'], 
+            recursion_desired=False)
+        client.disconnect()
+        self.assertEqual(['93.184.216.35'], result.addresses())
+        self.assertEqual(0, result.rcodes[1])
+        self.assertIn(('10.0.0.53', 'www.example.com'), 
+            client.resolver.asked)
+        self.assertIn(1, failed.errors)
+
+    def test_non_recursive_metrics(self):
+        '''test client metrics without recursion
+        '''
+        metrics = Metrics()
+        client = DNSClient(server='127.0.0.1', metrics=metrics)
+        client.resolver = FakeIterativeResolver(self.table, 
+            cache=client.cache)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.send_query('www.example.com', recursion_desired=False)
+        client.disconnect()
+        self.assertEqual(1, metrics.histograms[('query_seconds', 
+            None)].count)
+
+
+class ServerSelectorTestCase(unittest.TestCase):
+    '''server selection tests class
+    '''
+
+
+    def setUp(self):
+        '''set up
+        '''
+        self.clock = FakeClock()
+        self.selector = ServerSelector(clock=self.clock)
+        self.ok = make_responce()
+
+    def test_prefers_fastest_and_backs_off(self):
+        '''test selector
+        '''
+        self.selector.record_success('10.0.0.1', 0.2)
+        self.selector.record_success('10.0.0.2', 0.01)
+        self.assertEqual(['10.0.0.2', '10.0.0.1', '10.0.0.3'], 
+            self.selector.rank(['10.0.0.1', '10.0.0.2', '10.0.0.3']))
+        self.selector.record_failure('10.0.0.2')
+        self.assertEqual(['10.0.0.1', '10.0.0.3', '10.0.0.2'], 
+            self.selector.rank(['10.0.0.1', '10.0.0.2', '10.0.0.3']))
+        self.clock.now = 1
+        self.assertEqual('10.0.0.2', 
+            self.selector.rank(['10.0.0.1', '10.0.0.2'])[0])
+        self.assertEqual(0.2, self.selector.timeout('10.0.0.2'))
+        self.assertEqual(5, self.selector.timeout('10.0.0.3'))
+
+    def test_shared_between_threads(self):
+        '''test selector
+        '''
+        barrier = threading.Barrier(8)
+        def worker(index):
+            barrier.wait()
+            for i in range(500):
+                server = '10.0.1.{0}'.format(i % 4)
+                self.selector.record_success(server, 0.01)
+                self.selector.record_failure(server)
+                self.selector.rank(['10.0.1.{0}'.format(j) 
+                    for j in range(4)])
+        threads = [threading.Thread(target=worker, args=(i,)) 
+            for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([1000] * 4, [self.selector.stats(
+            '10.0.1.{0}'.format(j)).samples for j in range(4)])
+
+    def test_fanout_groups(self):
+        '''test selector
+        '''
+        groups = []
+        def send(group, timeout):
+            groups.append(group)
+            if '10.0.0.3' in group:
+                return ('10.0.0.3', self.ok)
+            return (None, None)
+        server, format = self.selector.query(['10.0.0.1', '10.0.0.2', 
+            '10.0.0.3'], send, fanout=2)
+        self.assertEqual('10.0.0.3', server)
+        self.assertEqual([['10.0.0.1', '10.0.0.2'], ['10.0.0.3']], groups)
+        self.assertEqual(1, self.selector.stats('10.0.0.1').failures)
+        self.assertEqual(1, self.selector.stats('10.0.0.3').samples)
+
+
+class TruncatingServerProtocol(asyncio.DatagramProtocol):
+    '''answers every udp query with empty truncated responce
+    '''
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        end = DNSQuestion().decode(data, 12)
+        self.transport.sendto(data[0:2] + b'\x83\x80\x00\x01' + 
+            b'\x00\x00\x00\x00\x00\x00' + data[12:end], addr)
+
+
+def serve_tcp_reversed(listener, batch):
+    '''answers one connection, each batch of queries in reverse order
+    '''
+    connection, address = listener.accept()
+    with connection:
+        try:
+            while True:
+                queries = []
+                for i in range(batch):
+                    length = struct.unpack('>H', 
+                        read_exact(connection, 2))[0]
+                    queries.append(read_exact(connection, length))
+                for index, query in enumerate(reversed(queries)):
+                    connection.sendall(frame(make_answer(query, 
+                        bytes([10, 0, 1, batch - index]))))
+        except ConnectionError:
+            pass
+
+
+class TCPTestCase(unittest.TestCase):
+    '''tcp transport tests class
+    '''
+
+
+    def test_pipelined_queries(self):
+        '''test tcp
+        '''
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        thread = threading.Thread(target=serve_tcp_reversed, 
+            args=(listener, 3))
+        thread.start()
+        encoder = QueryEncoder()
+        connection = TCPConnection('127.0.0.1', 
+            port=listener.getsockname()[1], timeout=2)
+        queries = [(i, encoder.encode('host{0}.com'.format(i), 1, True, 
+            i)) for i in range(1, 4)]
+        responces = connection.query_many(queries)
+        connection.close()
+        thread.join()
+        listener.close()
+        for i in range(3):
+            self.assertEqual(i + 1, responces[i].header.messageID)
+            self.assertEqual('10.0.1.{0}'.format(i + 1), 
+                responces[i].answers[0].resource_data.ip)
+
+    def test_malformed_tcp_responce(self):
+        '''test tcp
+        '''
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        def serve():
+            connection, address = listener.accept()
+            with connection:
+                length = struct.unpack('>H', read_exact(connection, 2))[0]
+                query = read_exact(connection, length)
+                connection.sendall(frame(b'\x00\x00\x81\x80'))
+                connection.sendall(frame(query[0:2] + b'\x81\x80\x00'))
+                connection.recv(1)
+        thread = threading.Thread(target=serve)
+        thread.start()
+        client = DNSClient(server='127.0.0.1', 
+            port=listener.getsockname()[1])
+        truncated = make_responce()
+        query = client.encoder.encode('big.example.com', 1, True, 4660)
+        with contextlib.redirect_stdout(io.StringIO()):
+            format = client.query_tcp('127.0.0.1', query, 4660, truncated)
+        client.disconnect()
+        thread.join()
+        listener.close()
+        self.assertIs(truncated, format)
+
+    def test_truncated_udp_falls_back_to_tcp(self):
+        '''test tcp
+        '''
+        async def handle(reader, writer):
+            length = struct.unpack('>H', await reader.readexactly(2))[0]
+            query = await reader.readexactly(length)
+            writer.write(frame(make_answer(query, b'\x0a\x00\x02\x01')))
+            await writer.drain()
+            writer.close()
+        async def run():
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                TruncatingServerProtocol, local_addr=('127.0.0.1', 0))
+            port = transport.get_extra_info('sockname')[1]
+            server = await asyncio.start_server(handle, '127.0.0.1', port)
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2)
+            answers = await client.resolve('big.example.com')
+            client.close()
+            transport.close()
+            server.close()
+            await server.wait_closed()
+            return answers
+        answers = asyncio.run(run())
+        self.assertEqual('10.0.2.1', answers[0].resource_data.ip)
+
+
+class FormerrOnEDNSProtocol(asyncio.DatagramProtocol):
+    '''old server rejecting queries with OPT record
+    '''
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data[11] == 1:
+            end = DNSQuestion().decode(data, 12)
+            self.transport.sendto(data[0:2] + b'\x81\x81\x00\x01' + 
+                b'\x00\x00\x00\x00\x00\x00' + data[12:end], addr)
+        else:
+            self.transport.sendto(make_answer(data, b'\x0a\x00\x03\x01'), 
+                addr)
+
+
+class EDNSTestCase(unittest.TestCase):
+    '''edns tests class
+    '''
+
+
+    def test_formerr_retries_without_edns(self):
+        '''test edns
+        '''
+        async def run():
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                FormerrOnEDNSProtocol, local_addr=('127.0.0.1', 0))
+            port = transport.get_extra_info('sockname')[1]
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2)
+            answers = await client.resolve('old.example.com')
+            client.close()
+            transport.close()
+            return answers
+        answers = asyncio.run(run())
+        self.assertEqual('10.0.3.1', answers[0].resource_data.ip)
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    '''benchmark corpus tests class
+    '''
+
+
+    def test_corpus_decodes(self):
+        '''test corpus
+        '''
+        corpus = dict(read_corpus())
+        self.assertIn('root_referral_com', corpus)
+        for name, message in corpus.items():
+            format = DNSMessageFormat()
+            format.decode(message)
+            self.assertEqual(1, format.header.qd_count)
+        format = DNSMessageFormat()
+        format.decode(corpus['cname_chain'])
+        self.assertEqual('e13678.dscb.akamaiedge.net', 
+            format.answers[2].resource_data.name)
+
+    def test_regressions(self):
+        '''test baseline comparison
+        '''
+        baseline = { 'decode/a':{ 'ops':100 }, 'decode/b':{ 'ops':100 }, 
+            'memory/a':{ 'bytes_per_record':10 } }
+        results = { 'decode/a':{ 'ops':90 }, 'decode/b':{ 'ops':60 } }
+        self.assertEqual([('decode/b', 100, 60)], 
+            regressions(results, baseline, 0.25))
+
+
+zone = [
+    'example.com. 3600 IN SOA ns1.example.com. admin.example.com. 1 7200 '
+        '3600 1209600 300',
+    'example.com. 3600 IN NS ns1.example.com.',
+    'www.example.com. 300 IN A 192.0.2.80',
+    'www.example.com. 300 IN AAAA 2001:db8::80',
+    'www.example.com. 300 IN TXT "v=spf1 -all" "second string"',
+    'example.com. 3600 IN MX 10 mail.example.com.',
+    '_sip._udp.example.com. 300 IN SRV 10 60 5060 sip.example.com.',
+    'alias.example.com. 300 IN CNAME www.example.com.',
+    'sub.example.com. 3600 IN NS ns.sub.example.com.',
+    'cdn.example.com. 300 IN CNAME edge.example.net.',
+    'loop.example.com. 300 IN CNAME loop.example.org.',
+    'example.net. 3600 IN SOA ns1.example.net. admin.example.net. 1 7200 '
+        '3600 1209600 300',
+    'edge.example.net. 60 IN CNAME e1.example.net.',
+    'e1.example.net. 20 IN A 192.0.2.1',
+    'example.org. 3600 IN SOA ns1.example.org. admin.example.org. 1 7200 '
+        '3600 1209600 300',
+    'loop.example.org. 300 IN CNAME loop.example.com.',
+    'ns.sub.example.com. 3600 IN A 127.0.0.2',
+]
+
+
+def example_zones():
+    '''zones loaded from zone
+    '''
+    zones = Zones()
+    zones.load(zone)
+    return zones
+
+async def start_stand_in(**options):
+    '''stand-in server for example zones on free port, returns (server,
+    port)
+    '''
+    server = StandInServer(example_zones(), **options)
+    return server, await server.start('127.0.0.1', 0)
+
+
+class StandInServerTestCase(unittest.TestCase):
+    '''stand-in server and load generator tests class
+    '''
+
+
+    def test_zone_answers(self):
+        '''test stand-in server
+        '''
+        async def run():
+            server, port = await start_stand_in()
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2, cache=DNSCache(max_size=0))
+            alias = await client.query('alias.example.com')
+            missing = await client.query('missing.example.com')
+            referral = await client.query('www.sub.example.com')
+            server.truncate = 1
+            truncated = await client.query('www.example.com')
+            client.close()
+            server.close()
+            return alias, missing, referral, truncated
+        alias, missing, referral, truncated = asyncio.run(run())
+        self.assertEqual(1, alias.header.aa)
+        self.assertEqual('www.example.com', 
+            alias.answers[0].resource_data.name)
+        self.assertEqual('192.0.2.80', alias.answers[1].resource_data.ip)
+        self.assertEqual(3, missing.header.rcode)
+        self.assertEqual(300, 
+            missing.authority_RRs[0].resource_data.minimum)
+        self.assertEqual(0, referral.header.aa)
+        self.assertEqual('sub.example.com', referral.authority_RRs[0].name)
+        self.assertEqual('127.0.0.2', 
+            referral.additional_RRs[0].resource_data.ip)
+        self.assertEqual(0, truncated.header.tc)
+        self.assertEqual('192.0.2.80', 
+            truncated.answers[0].resource_data.ip)
+
+    def test_load_generator(self):
+        '''test load generator
+        '''
+        async def run():
+            server, port = await start_stand_in(latency=0.01)
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2, cache=DNSCache(max_size=0))
+            generator = LoadGenerator(client, ['www.example.com'], qps=200, 
+                duration=0.25)
+            elapsed = await generator.run()
+            server.close()
+            return generator, elapsed
+        generator, elapsed = asyncio.run(run())
+        self.assertEqual(50, generator.sent)
+        self.assertEqual(50, len(generator.latencies))
+        self.assertGreaterEqual(min(generator.latencies), 0.01)
+        self.assertIn('50 answered', generator.summary(elapsed))
+
+    def test_load_generator_resolve(self):
+        '''test load generator through client cache
+        '''
+        async def run():
+            server, port = await start_stand_in(latency=0.05)
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2)
+            generator = LoadGenerator(client, ['www.example.com'], qps=200, 
+                duration=0.25, resolve=True)
+            await generator.run()
+            server.close()
+            return server, generator
+        server, generator = asyncio.run(run())
+        self.assertEqual(50, len(generator.latencies))
+        self.assertEqual(1, server.queries)
+        self.assertRaises(ValueError, LoadGenerator, None, [])
+
+
+@contextlib.contextmanager
+def stand_in_server(servers=None, **options):
+    '''stand-in server for example zones in background thread, yields
+    its port, appends server to servers list when given
+    '''
+    started = []
+    stop = threading.Event()
+    async def serve():
+        server, port = await start_stand_in(**options)
+        if servers is not None:
+            servers.append(server)
+        started.append(port)
+        while not stop.is_set():
+            await asyncio.sleep(0.01)
+        server.close()
+    thread = threading.Thread(target=asyncio.run, args=(serve(),))
+    thread.start()
+    while len(started) == 0:
+        stop.wait(0.01)
+    try:
+        yield started[0]
+    finally:
+        stop.set()
+        thread.join()
+
+
+class MetricsTestCase(unittest.TestCase):
+    '''instrumentation tests class
+    '''
+
+
+    def test_client_metrics(self):
+        '''test metrics
+        '''
+        events = []
+        metrics = Metrics(callback=lambda name, server, value, labels: 
+            events.append(name))
+        with stand_in_server() as port:
+            client = DNSClient(server='127.0.0.1', port=port, 
+                metrics=metrics)
+            with contextlib.redirect_stdout(io.StringIO()):
+                client.send_query('missing.example.com')
+                client.send_query('www.example.com')
+                client.send_query('www.example.com')
+            client.disconnect()
+        self.assertEqual(1, metrics.counter('cache_hits'))
+        self.assertEqual(2, metrics.counter('queries', '127.0.0.1'))
+        self.assertEqual(1, metrics.counter('responses', '127.0.0.1', 
+            rcode=3))
+        for stage in ('encode_seconds', 'send_seconds', 'wait_seconds', 
+                'decode_seconds', 'query_seconds'):
+            self.assertIn(stage, events)
+        text = metrics.prometheus()
+        self.assertIn('# TYPE dns_client_queries_total counter', text)
+        self.assertIn('dns_client_responses_total{server="127.0.0.1",' 
+            'rcode="0"} 1', text)
+        self.assertIn('dns_client_query_seconds_bucket{server="127.0.0.1",'
+            'le="+Inf"} 2', text)
+        self.assertIn('dns_client_query_seconds_count{server="127.0.0.1"} 2',
+            text)
+
+    def test_bucket_list(self):
+        '''test metrics
+        '''
+        metrics = Metrics(buckets=[1, 0.1])
+        metrics.observe('query_seconds', None, 0.5)
+        text = metrics.prometheus()
+        self.assertIn('dns_client_query_seconds_bucket{le="0.1"} 0', text)
+        self.assertIn('dns_client_query_seconds_bucket{le="1"} 1', text)
+        self.assertIn('dns_client_query_seconds_bucket{le="+Inf"} 1', text)
+
+
+class ResolverPoolTestCase(unittest.TestCase):
+    '''multi-process pool tests class
+    '''
+
+
+    def test_sharded_resolution(self):
+        '''test pool
+        '''
+        self.assertEqual(shard('WWW.Example.com.', 4), 
+            shard('www.example.com', 4))
+        names = ['www.example.com', 'alias.example.com'] + \
+            ['host{0}.example.com'.format(i) for i in range(10)]
+        output = io.StringIO()
+        with stand_in_server() as port:
+            pool = ResolverPool('127.0.0.1', processes=3, concurrency=4, 
+                timeout=2, json_output=True, output=output, port=port, 
+                chunk_size=2, queued_chunks=1)
+            pool.run(name for name in names)
+        results = dict((result['name'], result) for result in 
+            map(json.loads, output.getvalue().splitlines()))
+        self.assertEqual(set(names), set(results))
+        self.assertEqual(['192.0.2.80'], results['alias.example.com']
+            ['answers'])
+        self.assertEqual([], results['host3.example.com']['answers'])
+        self.assertEqual(12, len(pool.latencies))
+        self.assertEqual(0, pool.errors)
+
+
+class LookupTestCase(unittest.TestCase):
+    '''multi-type lookup tests class
+    '''
+
+
+    def test_parallel_types(self):
+        '''test lookup
+        '''
+        servers = []
+        with stand_in_server(servers=servers, latency=0.2) as port:
+            client = DNSClient(server='127.0.0.1', port=port)
+            result = client.lookup('www.example.com', ['A', 'AAAA', 'TXT'])
+            queries = servers[0].queries
+            mx = client.lookup('example.com', ['MX', 33])
+            srv = client.lookup('_sip._udp.example.com', ['SRV'])
+            cached = client.lookup('www.example.com', [1])
+            client.disconnect()
+        self.assertEqual(3, queries)
+        self.assertEqual(3, servers[0].max_in_flight)
+        self.assertEqual(['192.0.2.80', '2001:db8::80'], result.addresses())
+        self.assertEqual(['v=spf1 -all', 'second string'], 
+            result['TXT'][0].resource_data.strings)
+        self.assertEqual('mail.example.com', 
+            mx['MX'][0].resource_data.mail_exchanger)
+        self.assertEqual([], mx[33])
+        self.assertEqual(0, mx.rcodes[33])
+        self.assertEqual((10, 60, 5060, 'sip.example.com'), 
+            (srv['SRV'][0].resource_data.priority, 
+            srv['SRV'][0].resource_data.weight, 
+            srv['SRV'][0].resource_data.port, 
+            srv['SRV'][0].resource_data.target))
+        self.assertIs(result[1], cached[1])
+
+    def test_async_parallel_types(self):
+        '''test async lookup
+        '''
+        async def run():
+            server, port = await start_stand_in(latency=0.2)
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2)
+            result = await client.lookup('www.example.com', ('A', 'AAAA'))
+            client.close()
+            server.close()
+            return server, result
+        server, result = asyncio.run(run())
+        self.assertEqual(2, server.queries)
+        self.assertEqual(2, server.max_in_flight)
+        self.assertEqual(['192.0.2.80', '2001:db8::80'], result.addresses())
+
+
+class CNAMEChainTestCase(unittest.TestCase):
+    '''CNAME chasing tests class
+    '''
+
+
+    def test_negative_cname_entry(self):
+        '''test chain
+        '''
+        with stand_in_server() as port:
+            client = DNSClient(server='127.0.0.1', port=port)
+            nodata = client.lookup('www.example.com', ['CNAME'])
+            with contextlib.redirect_stdout(io.StringIO()):
+                answers = client.send_query('www.example.com')
+            client.disconnect()
+        self.assertEqual([], nodata['CNAME'])
+        self.assertEqual(['192.0.2.80'], [rr.resource_data.ip 
+            for rr in answers])
+
+    def test_chain_followed_and_cached(self):
+        '''test chain
+        '''
+        async def run():
+            server, port = await start_stand_in()
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=2, cache=DNSCache(clock=clock))
+            chased = await client.resolve('cdn.example.com')
+            queries = server.queries
+            edge = await client.resolve('edge.example.net')
+            target = await client.resolve('e1.example.net')
+            cached_queries = server.queries
+            clock.now = 30
+            expired = await client.resolve('cdn.example.com')
+            looping = await client.resolve('loop.example.com')
+            client.close()
+            server.close()
+            return (chased, queries, edge, target, cached_queries, expired, 
+                server.queries, looping)
+        clock = FakeClock()
+        (chased, queries, edge, target, cached_queries, expired, 
+            last_queries, looping) = asyncio.run(run())
+        self.assertEqual(['edge.example.net', 'e1.example.net', 
+            '192.0.2.1'], [rr.resource_data.name if rr.type == 5 else 
+            rr.resource_data.ip for rr in chased])
+        self.assertEqual(2, queries)
+        self.assertEqual(queries, cached_queries)
+        self.assertEqual(['edge.example.net', 'e1.example.net'], 
+            [rr.name for rr in edge])
+        self.assertEqual('192.0.2.1', target[0].resource_data.ip)
+        self.assertEqual(chased[0].name, expired[0].name)
+        self.assertEqual(cached_queries + 1, last_queries - 2)
+        self.assertEqual(['loop.example.com', 'loop.example.org'], 
+            [rr.name for rr in looping])
+
+    def test_client_chases_chain(self):
+        '''test chain in blocking client
+        '''
+        output = io.StringIO()
+        with stand_in_server() as port:
+            client = DNSClient(server='127.0.0.1', port=port)
+            with contextlib.redirect_stdout(output):
+                chased = client.send_query('cdn.example.com')
+                looping = client.send_query('loop.example.com')
+            client.disconnect()
+        self.assertEqual(2, len(looping))
+        self.assertEqual('192.0.2.1', chased[2].resource_data.ip)
+        self.assertEqual('192.0.2.1\nCNAME chain too long or looping: ' 
+            'loop.example.com\n', output.getvalue())
+
+    def test_chain_target(self):
+        '''test chain target
+        '''
+        cname = make_rr('a.com', 5, 60, name='b.com')
+        address = make_rr('b.com', 1, 60, ip='10.0.0.1')
+        self.assertEqual('b.com', chain_target([cname], 'A.com.', 1))
+        self.assertIsNone(chain_target([cname, address], 'a.com', 1))
+        self.assertIsNone(chain_target([cname], 'a.com', 5))
+        self.assertIsNone(chain_target([], 'a.com', 1))
+
+
+def serve_after_drops(sock, drops, replies):
+    '''ignores first drops queries, then answers replies queries
+    '''
+    for i in range(drops + replies):
+        query, address = sock.recvfrom(512)
+        if i >= drops:
+            sock.sendto(make_answer(query, b'\x0a\x00\x04\x01'), address)
+
+
+class DropFirstProtocol(asyncio.DatagramProtocol):
+    '''lossy server dropping first query
+    '''
+
+
+    def __init__(self):
+        self.received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if self.received > 1:
+            self.transport.sendto(make_answer(data, b'\x0a\x00\x04\x02'), 
+                addr)
+
+
+class RetrySchedulerTestCase(unittest.TestCase):
+    '''retransmission tests class
+    '''
+
+
+    def test_backoff_within_budget(self):
+        '''test scheduler
+        '''
+        clock = FakeClock()
+        scheduler = RetryScheduler(budget=2, attempts=5, 
+            initial_timeout=0.5, clock=clock)
+        timeouts = []
+        for timeout in scheduler.timeouts():
+            timeouts.append(timeout)
+            clock.now += timeout
+        self.assertEqual([0.5, 1.0, 0.5], timeouts)
+
+    def test_retransmits_after_loss(self):
+        '''test scheduler
+        '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        thread = threading.Thread(target=serve_after_drops, 
+            args=(sock, 1, 1))
+        thread.start()
+        metrics = Metrics()
+        client = DNSClient(server='127.0.0.1', port=sock.getsockname()[1], 
+            scheduler=RetryScheduler(initial_timeout=0.1), metrics=metrics)
+        with contextlib.redirect_stdout(io.StringIO()):
+            answers = client.send_query('lossy.example.com')
+        client.disconnect()
+        thread.join()
+        sock.setblocking(False)
+        self.assertRaises(BlockingIOError, sock.recvfrom, 512)
+        sock.close()
+        self.assertEqual('10.0.4.1', answers[0].resource_data.ip)
+        self.assertEqual(2, metrics.counter('queries', '127.0.0.1'))
+        self.assertEqual(1, metrics.counter('retries', '127.0.0.1', 
+            reason='timeout'))
+        stats = client.selector.stats('127.0.0.1')
+        self.assertEqual((0, 0), (stats.samples, stats.failures))
+
+    def test_timeout_is_result(self):
+        '''test scheduler
+        '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        client = DNSClient(server='127.0.0.1', port=sock.getsockname()[1], 
+            scheduler=RetryScheduler(budget=0.3, initial_timeout=0.1))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            answers = client.send_query('silent.example.com')
+        client.disconnect()
+        sock.close()
+        self.assertEqual([], answers)
+        self.assertEqual('Time Out: 127.0.0.1\n', output.getvalue())
+
+    def test_async_retransmits_after_loss(self):
+        '''test scheduler
+        '''
+        async def run():
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                DropFirstProtocol, local_addr=('127.0.0.1', 0))
+            client = AsyncDNSClient(server='127.0.0.1', 
+                port=transport.get_extra_info('sockname')[1], 
+                scheduler=RetryScheduler(initial_timeout=0.1))
+            answers = await client.resolve('lossy.example.com')
+            client.close()
+            transport.close()
+            return answers, protocol.received
+        answers, received = asyncio.run(run())
+        self.assertEqual('10.0.4.2', answers[0].resource_data.ip)
+        self.assertEqual(2, received)
+
+
+class SharedResolverTestCase(unittest.TestCase):
+    '''thread-safe resolver tests class
+    '''
+
+
+    def test_many_threads_few_sockets(self):
+        '''test shared resolver
+        '''
+        names = ['www.example.com', 'alias.example.com', 'cdn.example.com'] + \
+            ['host{0}.example.com'.format(i) for i in range(97)]
+        results = {}
+        barrier = threading.Barrier(len(names))
+        def worker(name):
+            barrier.wait()
+            answers = resolver.resolve(name)
+            results[name] = [rr.resource_data.ip for rr in answers 
+                if rr.type == 1]
+        servers = []
+        with stand_in_server(servers=servers, latency=0.05) as port:
+            resolver = SharedResolver('127.0.0.1', sockets=2, port=port)
+            threads = [threading.Thread(target=worker, args=(name,)) 
+                for name in names]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            cached = resolver.resolve('cdn.example.com')
+            resolver.close()
+        self.assertEqual(100, len(results))
+        self.assertEqual(['192.0.2.80'], results['alias.example.com'])
+        self.assertEqual(['192.0.2.1'], results['cdn.example.com'])
+        self.assertEqual([], results['host42.example.com'])
+        self.assertEqual('192.0.2.1', cached[2].resource_data.ip)
+        self.assertGreater(servers[0].max_in_flight, len(resolver.sockets))
+        self.assertEqual([{}, {}], [shared.pending for shared 
+            in resolver.sockets])
+
+    def test_coalescing(self):
+        '''test shared resolver
+        '''
+        barrier = threading.Barrier(20)
+        responces = []
+        def worker():
+            barrier.wait()
+            responces.append(resolver.query('www.example.com'))
+        with stand_in_server(latency=0.1) as port:
+            resolver = SharedResolver('127.0.0.1', sockets=2, port=port)
+            threads = [threading.Thread(target=worker) for i in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            resolver.close()
+        self.assertEqual(19, resolver.coalesced)
+        self.assertEqual({}, resolver.inflight)
+        self.assertEqual(1, len(set(id(responce) for responce 
+            in responces)))
+
+    def test_serve_stale(self):
+        '''test shared resolver refresh
+        '''
+        clock = FakeClock()
+        servers = []
+        with stand_in_server(servers=servers) as port:
+            resolver = SharedResolver('127.0.0.1', sockets=1, port=port, 
+                cache=DNSCache(clock=clock, stale_ttl=3600), 
+                scheduler=RetryScheduler(budget=0.5))
+            first = resolver.resolve('www.example.com')
+            clock.now = 1000
+            stale = resolver.resolve('www.example.com')
+            deadline = time.monotonic() + 5
+            while resolver.refreshes == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            refreshed = resolver.resolve('www.example.com')
+            resolver.serve_stale = False
+            clock.now = 2000
+            fresh = resolver.resolve('www.example.com')
+            resolver.serve_stale = True
+        clock.now = 3000
+        down = resolver.resolve('www.example.com')
+        resolver.close()
+        self.assertEqual(3, servers[0].queries)
+        self.assertEqual(1, resolver.refreshes)
+        self.assertIs(first, stale)
+        self.assertIsNot(stale, refreshed)
+        self.assertIsNot(refreshed, fresh)
+        self.assertIs(fresh, down)
+        self.assertEqual('192.0.2.80', down[0].resource_data.ip)
+
+
+class SnapshotTestCase(unittest.TestCase):
+    '''cache snapshot tests class
+    '''
+
+
+    def test_round_trip(self):
+        '''test snapshot
+        '''
+        clock = FakeClock()
+        cache = DNSCache(clock=clock)
+        format = DNSMessageFormat()
+        format.decode(message1)
+        cache.store_response('tags.bluekai.com', 1, 1, format)
+        format = DNSMessageFormat()
+        format.decode(nxdomain)
+        cache.store_response('a.com', 1, 1, format)
+        cache.put('gone.com', 1, 1, [], 3, 5)
+        clock.now = 10
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory + '/cache'
+            self.assertEqual(0, load_snapshot(cache, path))
+            self.assertEqual(len(cache) - 1, save_snapshot(cache, path, 
+                lambda: 1000))
+            loaded = DNSCache(clock=FakeClock())
+            self.assertEqual(len(cache) - 1, load_snapshot(loaded, path, 
+                lambda: 1020))
+            self.assertEqual(0, load_snapshot(DNSCache(), path, 
+                lambda: 10000))
+        self.assertIsNone(loaded.get('gone.com', 1))
+        self.assertEqual(3, loaded.get('a.com', 1).rcode)
+        self.assertTrue(loaded.get('a.com', 1).is_negative())
+        original = cache.get('tags.bluekai.com', 1)
+        entry = loaded.get('tags.bluekai.com', 1)
+        self.assertEqual(original.expires - 30, entry.expires)
+        self.assertEqual([(rr.name, rr.type, rr.ttl) for rr 
+            in original.records], [(rr.name, rr.type, rr.ttl) for rr 
+            in entry.records])
+        self.assertEqual(original.records[-1].resource_data.ip, 
+            entry.records[-1].resource_data.ip)
+        records, target = loaded.get_chain('tags.bluekai.com', 1)
+        self.assertIsNone(target)
+
+
+class RefreshTestCase(unittest.TestCase):
+    '''prefetch and serve-stale tests class
+    '''
+
+
+    def test_serve_stale(self):
+        '''test async client refresh
+        '''
+        clock = FakeClock()
+        async def run():
+            server, port = await start_stand_in()
+            client = AsyncDNSClient(server='127.0.0.1', port=port, 
+                timeout=0.2, cache=DNSCache(clock=clock, 
+                    prefetch_fraction=0.1, stale_ttl=3600))
+            first = await client.resolve('www.example.com')
+            clock.now = 280
+            for i in range(2):
+                await client.resolve('www.example.com')
+            await asyncio.gather(*client.refreshing)
+            prefetched = await client.resolve('www.example.com')
+            clock.now = 1000
+            stale = await client.resolve('www.example.com')
+            looked = await client.lookup('www.example.com', [1])
+            await asyncio.gather(*client.refreshing)
+            refreshed = await client.resolve('www.example.com')
+            server.close()
+            clock.now = 2000
+            down = await client.resolve('www.example.com')
+            await asyncio.gather(*client.refreshing)
+            client.close()
+            return server, client, prefetched, first, stale, looked, \
+                refreshed, down
+        server, client, prefetched, first, stale, looked, refreshed, \
+            down = asyncio.run(run())
+        self.assertEqual(3, server.queries)
+        self.assertEqual(2, client.refreshes)
+        self.assertIsNot(first, prefetched)
+        self.assertIs(prefetched, stale)
+        self.assertIs(stale, looked[1])
+        self.assertIsNot(stale, refreshed)
+        self.assertIs(refreshed, down)
+        self.assertEqual('192.0.2.80', down[0].resource_data.ip)
+
+def ethernet_frame(source, destination, protocol, transport, payload):
+    '''ethernet frame with IPv4 or IPv6 packet, addresses packed
+    '''
+    if len(source) == 4:
+        header = struct.pack('>BBHHHBBH', 0x45, 0, 20 + len(transport) + 
+            len(payload), 0, 0x4000, 64, protocol, 0) + source + \
+            destination
+        ethertype = b'\x08\x00'
+    else:
+        header = struct.pack('>IHBB', 6 << 28, len(transport) + 
+            len(payload), protocol, 64) + source + destination
+        ethertype = b'\x86\xdd'
+    return b'\x00' * 12 + ethertype + header + transport + payload
+
+def udp_frame(source, destination, source_port, destination_port, 
+        payload):
+    '''ethernet frame with udp datagram
+    '''
+    return ethernet_frame(source, destination, 17, struct.pack('>HHHH', 
+        source_port, destination_port, 8 + len(payload), 0), payload)
+
+def tcp_frame(source, destination, source_port, destination_port, seq, 
+        flags, payload):
+    '''ethernet frame with tcp segment
+    '''
+    return ethernet_frame(source, destination, 6, struct.pack('>HHIIBBHHH', 
+        source_port, destination_port, seq, 0, 5 << 4, flags, 65535, 0, 
+        0), payload)
+
+def pcap(frames):
+    '''little endian ethernet pcap file
+    '''
+    data = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+    for frame in frames:
+        data += struct.pack('<IIII', 0, 0, len(frame), len(frame)) + frame
+    return data
+
+
+class DumpReaderTestCase(unittest.TestCase):
+    '''capture reader tests class
+    '''
+
+
+    def test_pcap(self):
+        '''test dump reader
+        '''
+        corpus = [message for name, message in read_corpus()[0:4]]
+        client = socket.inet_pton(socket.AF_INET6, '2001:db8::1')
+        server = socket.inet_pton(socket.AF_INET6, '2001:db8::53')
+        framed = b''.join(struct.pack('>H', len(message)) + message 
+            for message in corpus[1:4])
+        frames = [
+            udp_frame(b'\x0a\0\0\1', b'\x0a\0\0\2', 53, 40000, 
+                corpus[0]),
+            udp_frame(b'\x0a\0\0\1', b'\x0a\0\0\2', 80, 40000, 
+                corpus[0]),
+            udp_frame(b'\x0a\0\0\1', b'\x0a\0\0\2', 53, 40000, 
+                b'\xff' * 5),
+            tcp_frame(server, client, 53, 40001, 1000, 0x12, b''),
+            tcp_frame(server, client, 53, 40001, 1001, 0x10, framed[0:7]),
+            tcp_frame(server, client, 53, 40001, 1001, 0x10, framed[0:7]),
+            tcp_frame(server, client, 53, 40001, 1008, 0x18, framed[7:]),
+            tcp_frame(server, client, 53, 40001, 1001 + len(framed), 0x11, 
+                b''),
+        ]
+        reader = DumpReader(chunk_size=100)
+        messages = list(reader.pcap(io.BytesIO(pcap(frames))))
+        self.assertEqual(8, reader.packets)
+        self.assertEqual(1, reader.malformed)
+        self.assertEqual({}, reader.flows)
+        self.assertEqual([message.header.messageID for message 
+            in messages], [struct.unpack('>H', message[0:2])[0] for message 
+            in corpus])
+        self.assertEqual('tags.bluekai.com', messages[0].questions[0].name)
+        self.assertRaises(ValueError, list, reader.pcap(io.BytesIO(
+            b'\x0a\x0d\x0d\x0a' + b'\0' * 20)))
+
+    def test_framed(self):
+        '''test dump reader
+        '''
+        corpus = [message for name, message in read_corpus()]
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory + '/dump'
+            with open(path, 'wb') as stream:
+                write_framed(stream, corpus)
+                stream.write(b'\x00\x40truncated')
+            reader = DumpReader(lazy=False, chunk_size=64)
+            messages = list(reader.read(path))
+        self.assertEqual(len(corpus), len(messages))
+        self.assertEqual(len(corpus), reader.messages)
+        format = DNSMessageFormat()
+        format.decode(corpus[-1])
+        self.assertEqual([rr.name for rr in format.answers], 
+            [rr.name for rr in messages[-1].answers])
+
+
+class ResponseTableTestCase(unittest.TestCase):
+    '''columnar decode tests class
+    '''
+
+
+    def test_columns_match_objects(self):
+        '''test response table
+        '''
+        corpus = [message for name, message in read_corpus()]
+        table = ResponseTable()
+        self.assertEqual(len(corpus), table.extend(corpus[0:1] + 
+            [corpus[0][0:-3], b'\x00' * 5] + corpus[1:]))
+        self.assertEqual(2, table.malformed)
+        rows = list(table.answers())
+        expected = []
+        for index, message in enumerate(corpus):
+            format = DNSMessageFormat()
+            format.decode(message)
+            question = format.questions[0]
+            self.assertEqual(format.header.messageID, 
+                table.message_ids[index])
+            self.assertEqual(question.name, 
+                table.names[table.qnames[index]])
+            for rr in format.answers:
+                address = None
+                if rr.type in (1, 28):
+                    address = rr.resource_data.ip
+                expected.append((question.name, question.type, 
+                    format.header.rcode, rr.name, rr.type, rr.ttl, address))
+        self.assertEqual(expected, rows)
+        self.assertEqual(len(rows) * 16, len(table.answer_addresses))
+        self.assertEqual(len(set(table.names)), len(table.names))
+
+    def test_malformed_address_row(self):
+        '''test response table
+        '''
+        table = ResponseTable()
+        table.add(message1[:-6] + b'\x00\x05\xad\xc0\xdc\x40\x00')
+        table.add(message1)
+        self.assertEqual([5, 1, 5, 1], list(table.answer_types))
+        self.assertEqual([11, 5, 11, 4], list(table.answer_lengths))
+        self.assertEqual([None, None, None, '173.192.220.64'], 
+            [table.address(row) for row in range(4)])
+
+
+class InterfaceTestCase(unittest.TestCase):
+    '''command line tests class
+    '''
+
+
+    def test_servers_before_name(self):
+        '''test arguments
+        '''
+        parsed = parse_arguments(['-s', '8.8.8.8', 'vk.com'])
+        self.assertEqual(['8.8.8.8'], parsed.server)
+        self.assertEqual('vk.com', parsed.host_name)
+        parsed = parse_arguments(['-s', '8.8.8.8', '-s', '1.1.1.1', 
+            'vk.com'])
+        self.assertEqual(['8.8.8.8', '1.1.1.1'], parsed.server)
+        self.assertEqual('vk.com', parsed.host_name)
+
+    def test_types_before_name(self):
+        '''test arguments
+        '''
+        parsed = parse_arguments(['-T', 'A', '-T', 'AAAA', 'example.com'])
+        self.assertEqual([1, 28], parsed.type)
+        self.assertEqual('example.com', parsed.host_name)
+        with contextlib.redirect_stderr(io.StringIO()) as error:
+            self.assertRaises(SystemExit, parse_arguments, ['-T', 'FOO', 
+                'example.com'])
+        self.assertIn('Unknown record type FOO', error.getvalue())
+
+    def test_batch_options(self):
+        '''test arguments
+        '''
+        parsed = parse_arguments(['-b', 'names.txt', '-s', '1.1.1.1', 
+            '-T', 'AAAA'])
+        self.assertEqual([28], parsed.type)
+        for args in [['-s', '8.8.8.8', '-s', '1.1.1.1'], ['-T', 'A', '-T', 
+                'AAAA'], ['-n'], ['-f', '2'], ['-m'], ['--cache-file', 
+                'cache.bin']]:
+            with contextlib.redirect_stderr(io.StringIO()) as error:
+                self.assertRaises(SystemExit, parse_arguments, 
+                    ['-b', 'names.txt'] + args)
+            self.assertIn('not supported with --batch', error.getvalue())
+
+
 if __name__ == "__main__":
     unittest.main()